@@ -1,3 +1,19 @@
+import os
+import shutil
+
+
+def on_starting(server):
+    _dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if _dir:
+        shutil.rmtree(_dir, ignore_errors=True)
+        os.makedirs(_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
 
 def pre_request(worker, req):
     if '/health_check' in req.path:
@@ -1,10 +1,30 @@
 from starlette.routing import Route, Mount
 from src.apis.health_check import HealthCheck
-from src.apis.balance import BalanceAPI
-from src.apis.nft import NFTAPI
+from src.apis.balance import BalanceAPI, BalanceBatchAPI
+from src.apis.nft import NFTAPI, NFTBatchAPI
+from src.apis.debug import AllocationAPI, MongoPoolAPI, HttpClientAPI, CoalescingAPI, MongoWriteAPI, PostgresPoolAPI, LocalCacheAPI
+from src.apis.metrics import MetricsAPI
+from src.config import config
 
 routes = [
     Route("/health_check", HealthCheck),
+    Route("/metrics", MetricsAPI),
     Route("/balance", BalanceAPI),
+    Route("/balance/batch", BalanceBatchAPI),
     Route("/nft", NFTAPI),
+    Route("/nft/batch", NFTBatchAPI),
 ]
+
+# Internal state (source locations, partner hosts, pool stats), only served when DEBUG_ENDPOINTS is set.
+debug_routes = [
+    Route("/debug/allocations", AllocationAPI),
+    Route("/debug/mongo_pool", MongoPoolAPI),
+    Route("/debug/mongo_writes", MongoWriteAPI),
+    Route("/debug/postgres_pool", PostgresPoolAPI),
+    Route("/debug/http", HttpClientAPI),
+    Route("/debug/coalescing", CoalescingAPI),
+    Route("/debug/local_cache", LocalCacheAPI),
+]
+
+if config.DEBUG_ENDPOINTS:
+    routes += debug_routes
@@ -1,6 +1,6 @@
 from starlette.endpoints import HTTPEndpoint
 from src.lib.executor import executor
-from src.schema.balance import GetBalance, ChangeBalance
+from src.schema.balance import GetBalance, ChangeBalance, ChangeBalanceBatch
 from src.helper.balance import BalanceHelper
 from src.lib.cache import Cache
 
@@ -17,3 +17,10 @@ class BalanceAPI(HTTPEndpoint):
     async def get(self, query_params: dict):
         _result = await _helper.get_balance(query_params)
         return _result
+
+
+class BalanceBatchAPI(HTTPEndpoint):
+    @executor(form_data=ChangeBalanceBatch)
+    async def post(self, form_data: dict):
+        _result = await _helper.change_balance_batch(form_data)
+        return _result
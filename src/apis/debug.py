@@ -0,0 +1,58 @@
+from starlette.endpoints import HTTPEndpoint
+from src.lib.executor import executor
+from src.lib.exception import NotFound
+from src.lib.profiler import profiler
+from src.connect import mongo_client, database
+from src.lib.http import http_pool
+from src.lib.cache import LocalCache
+from src.lib.mongo import flights as mongo_flights
+from src.lib.postgres import PostgresClient
+
+
+class AllocationAPI(HTTPEndpoint):
+    @executor()
+    async def get(self):
+        if not profiler.enabled:
+            raise NotFound(errors="Allocation profiling is disabled")
+        return profiler.report()
+
+
+class MongoPoolAPI(HTTPEndpoint):
+    @executor()
+    async def get(self):
+        return mongo_client.pool_monitor.stats()
+
+
+class HttpClientAPI(HTTPEndpoint):
+    @executor()
+    async def get(self):
+        return http_pool.stats()
+
+
+class CoalescingAPI(HTTPEndpoint):
+    @executor()
+    async def get(self):
+        return {
+            "mongo": mongo_flights.stats(),
+            "postgres": PostgresClient.flights.stats(),
+        }
+
+
+class MongoWriteAPI(HTTPEndpoint):
+    @executor()
+    async def get(self):
+        return mongo_client.write_stats()
+
+
+class PostgresPoolAPI(HTTPEndpoint):
+    @executor()
+    async def get(self):
+        if not database:
+            raise NotFound(errors="Postgres is not configured")
+        return database.pool_stats()
+
+
+class LocalCacheAPI(HTTPEndpoint):
+    @executor()
+    async def get(self):
+        return [local.stats() for local in LocalCache.instances]
@@ -0,0 +1,10 @@
+from starlette.endpoints import HTTPEndpoint
+from starlette.responses import Response
+from src.lib.executor import executor
+from src.lib import metrics
+
+
+class MetricsAPI(HTTPEndpoint):
+    @executor()
+    async def get(self):
+        return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
@@ -1,6 +1,7 @@
 from starlette.endpoints import HTTPEndpoint
+from starlette.responses import StreamingResponse
 from src.lib.executor import executor
-from src.schema.nft import AddNFT, ShowNFT
+from src.schema.nft import AddNFT, AddNFTBatch, ShowNFT
 from src.helper.nft import NFTHelper
 from src.lib.cache import Cache
 
@@ -15,5 +16,16 @@ class NFTAPI(HTTPEndpoint):
 
     @executor(query_params=ShowNFT)
     async def get(self, query_params: dict):
+        if query_params.get("stream"):
+            return StreamingResponse(
+                _helper.stream_nft(query_params), media_type="application/x-ndjson"
+            )
         _result = await _helper.show_nft(query_params)
         return _result
+
+
+class NFTBatchAPI(HTTPEndpoint):
+    @executor(form_data=AddNFTBatch)
+    async def post(self, form_data: dict):
+        _result = await _helper.add_nft_batch(form_data)
+        return _result
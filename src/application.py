@@ -5,7 +5,15 @@ from starlette.exceptions import HTTPException
 from starlette.middleware.cors import CORSMiddleware
 from src.apis import routes
 from src.lib.logger import DefaultFormatter
-import json
+from src.lib.profiler import profiler
+from src.lib import serializer
+from src.lib.http import http_pool
+from src.lib.cache import LocalCache
+from src.lib.mongo import flights as mongo_flights
+from src.lib.postgres import PostgresClient, SessionMiddleware, get_session_context
+from src.connect import mongo_client, redis, database
+from src.config import config
+import asyncio
 import logging
 
 
@@ -15,7 +23,7 @@ class Application(Starlette):
 
         async def exc_method_not_allow(request: Request, exc: HTTPException):
             return Response(
-                content=json.dumps(
+                content=serializer.dumps(
                     {"data": "", "msg": "Method not allow", "error": {}}
                 ),
                 status_code=405,
@@ -24,7 +32,7 @@ class Application(Starlette):
 
         async def exc_not_found(request: Request, exc: HTTPException):
             return Response(
-                content=json.dumps({"data": "", "msg": "Not found", "error": {}}),
+                content=serializer.dumps({"data": "", "msg": "Not found", "error": {}}),
                 status_code=404,
                 headers={"Content-type": "application/json"},
             )
@@ -46,6 +54,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+if database:
+    app.add_middleware(SessionMiddleware, database=database)
 
 
 @app.on_event("startup")
@@ -61,7 +71,59 @@ async def startup_event():
     handler.setFormatter(formatter)
     logger.addHandler(handler)
 
+    profiler.configure(
+        enabled=config.PROFILE_ALLOCATIONS,
+        sample_rate=config.PROFILE_SAMPLE_RATE,
+        frames=config.PROFILE_TRACE_FRAMES,
+    )
+
+    mongo_flights.enabled = config.COALESCE_READS
+    PostgresClient.flights.enabled = config.COALESCE_READS
+
+    http_pool.configure(
+        max_connections=config.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=config.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY,
+        timeout=config.HTTP_TIMEOUT,
+        http2=config.HTTP2,
+        max_retries=config.HTTP_MAX_RETRIES,
+        backoff_base=config.HTTP_BACKOFF_BASE,
+        backoff_max=config.HTTP_BACKOFF_MAX,
+        hedge_delay=config.HTTP_HEDGE_DELAY,
+        host_concurrency=config.HTTP_HOST_CONCURRENCY,
+        breaker_threshold=config.HTTP_BREAKER_THRESHOLD,
+        breaker_reset=config.HTTP_BREAKER_RESET,
+    )
+
+    mongo_client.connect()
+    if database:
+        database.connect(
+            pool_size=config.POSTGRES_POOL_SIZE,
+            max_overflow=config.POSTGRES_MAX_OVERFLOW,
+            pool_recycle=config.POSTGRES_POOL_RECYCLE,
+            pool_pre_ping=True,
+        )
+        database.make_session(scope=get_session_context)
+
+    if config.MONGO_INDEX_MODE == "ensure":
+        await mongo_client.ensure_indexes()
+    elif config.MONGO_INDEX_MODE == "check":
+        await mongo_client.check_indexes()
+
+    if redis:
+        await redis.connect()
+        if LocalCache.instances:
+            app.state.cache_listener = asyncio.create_task(redis.listen())
+
 
 @app.on_event("shutdown")
 async def app_shutdown():
-    pass
+    if getattr(app.state, "cache_listener", None):
+        app.state.cache_listener.cancel()
+    if redis:
+        await redis.disconnect()
+    await mongo_client.drain()
+    mongo_client.disconnect()
+    if database:
+        await database.disconnect()
+    await http_pool.close()
@@ -1,4 +1,5 @@
 from pydantic_settings import BaseSettings
+from typing import Optional
 
 
 class Config(BaseSettings):
@@ -8,5 +9,49 @@ class Config(BaseSettings):
     URI: str
     DB_NAME: str
 
+    MONGO_INDEX_MODE: str = "ensure"
+    MONGO_MAX_POOL_SIZE: int = 100
+    MONGO_MIN_POOL_SIZE: int = 0
+    MONGO_MAX_IDLE_TIME_MS: Optional[int] = None
+    MONGO_WAIT_QUEUE_TIMEOUT_MS: Optional[int] = None
+    MONGO_SERVER_SELECTION_TIMEOUT_MS: int = 30000
+    MONGO_CONNECT_TIMEOUT_MS: int = 20000
+    MONGO_COMPRESSORS: Optional[str] = None
+    MONGO_WRITE_BEHIND: bool = False
+    MONGO_WRITE_BEHIND_MAX_SIZE: int = 10000
+    MONGO_WRITE_BEHIND_BATCH_SIZE: int = 500
+    MONGO_WRITE_BEHIND_INTERVAL: float = 0.05
+
+    REDIS_URL: Optional[str] = None
+    POSTGRES_URI: Optional[str] = None
+    POSTGRES_POOL_SIZE: int = 5
+    POSTGRES_MAX_OVERFLOW: int = 10
+    POSTGRES_POOL_RECYCLE: int = 7200
+
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_KEEPALIVE_EXPIRY: float = 30
+    HTTP_TIMEOUT: float = 10
+    HTTP2: bool = False
+    HTTP_MAX_RETRIES: int = 2
+    HTTP_BACKOFF_BASE: float = 0.1
+    HTTP_BACKOFF_MAX: float = 2
+    HTTP_HEDGE_DELAY: Optional[float] = None
+    HTTP_HOST_CONCURRENCY: int = 50
+    HTTP_BREAKER_THRESHOLD: int = 5
+    HTTP_BREAKER_RESET: float = 30
+    BALANCE_CACHE_TTL: int = 5
+    LOCAL_CACHE_SIZE: int = 0
+    LOCAL_CACHE_TTL: float = 1
+    NFT_STREAM_BATCH_SIZE: int = 500
+    NFT_INSERT_CHUNK_SIZE: int = 1000
+    COALESCE_READS: bool = True
+    ASYNC_TASK_CONCURRENCY: int = 100
+
+    PROFILE_ALLOCATIONS: bool = False
+    PROFILE_SAMPLE_RATE: float = 1
+    PROFILE_TRACE_FRAMES: int = 1
+    DEBUG_ENDPOINTS: bool = False
+
 
 config = Config()
@@ -1,6 +1,27 @@
 from src.lib.mongo import MongoClient
+from src.lib.postgres import Postgres
 from src.config import config
 from src.lib.http import AsyncHttpClient
-from src.lib.cache import Cache
+from src.lib.cache import Cache, LocalCache
 
-mongo_client = MongoClient(config.URI, config.DB_NAME)
+mongo_client = MongoClient(
+    config.URI,
+    config.DB_NAME,
+    {
+        "maxPoolSize": config.MONGO_MAX_POOL_SIZE,
+        "minPoolSize": config.MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": config.MONGO_MAX_IDLE_TIME_MS,
+        "waitQueueTimeoutMS": config.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": config.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "connectTimeoutMS": config.MONGO_CONNECT_TIMEOUT_MS,
+        **({"compressors": config.MONGO_COMPRESSORS} if config.MONGO_COMPRESSORS else {}),
+    },
+    write_behind={
+        "max_size": config.MONGO_WRITE_BEHIND_MAX_SIZE,
+        "batch_size": config.MONGO_WRITE_BEHIND_BATCH_SIZE,
+        "interval": config.MONGO_WRITE_BEHIND_INTERVAL,
+    },
+)
+redis = Cache.config(config.REDIS_URL) if config.REDIS_URL else None
+database = Postgres(config.POSTGRES_URI) if config.POSTGRES_URI else None
+local_cache = LocalCache(config.LOCAL_CACHE_SIZE, config.LOCAL_CACHE_TTL, "redis") if config.LOCAL_CACHE_SIZE else None
@@ -1,4 +1,8 @@
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from src.config import config
 from src.lib.exception import NotFound
+from src.lib.mongo import increment_query
 from src.models import balance_collection
 
 
@@ -6,33 +10,69 @@ class BalanceHelper:
     def __init__(self) -> None:
         pass
 
-    async def change_balance(self, data: dict) -> str:
+    def _amount(self, data: dict) -> int:
+        amount = data.get("amount") or 0
+        if data.get("method") != "+":
+            amount = -amount
+        return amount
+
+    async def change_balance(self, data: dict) -> dict:
         address = data.get("address")
-        amount = data.get("amount")
-        method = data.get("method")
 
-        balance = await balance_collection.find_one(filter={"address": address})
-        if not balance:
-            if not amount:
-                amount = 0
-            data = {"address": address, "amount": amount}
-            await balance_collection.insert_one(data)
-        elif method == "+":
-            await balance_collection.update(
-                filter={"address": address},
-                data={"amount": balance.get("amount") + amount},
-            )
-        else:
-            await balance_collection.update(
-                filter={"address": address},
-                data={"amount": balance.get("amount") - amount},
+        balance = await balance_collection.increment(
+            filter={"address": address},
+            data={"amount": self._amount(data)},
+        )
+        await balance_collection.invalidate({"address": address})
+
+        return balance
+
+    async def change_balance_batch(self, data: dict) -> list:
+        items = data.get("items")
+        requests = [
+            UpdateOne(
+                {"address": item.get("address")},
+                increment_query({"amount": self._amount(item)}),
+                upsert=True,
             )
+            for item in items
+        ]
+
+        errors = {}
+        try:
+            result = await balance_collection.bulk_write(requests, ordered=False)
+            upserted = set(result.upserted_ids.keys())
+        except BulkWriteError as e:
+            upserted = {i.get("index") for i in e.details.get("upserted", [])}
+            errors = {i.get("index"): i.get("errmsg") for i in e.details.get("writeErrors", [])}
+
+        addresses = list({item.get("address") for item in items})
+        await balance_collection.invalidate(*[{"address": i} for i in addresses])
+        balances = await balance_collection.find(
+            filter={"address": {"$in": addresses}},
+            projection={"_id": 0, "address": 1, "amount": 1},
+        )
+        balances = {i.get("address"): i.get("amount") for i in balances}
+
+        _result = []
+        for index, item in enumerate(items):
+            address = item.get("address")
+            if index in errors:
+                _result.append({"address": address, "status": "failed", "error": errors[index]})
+                continue
+            _result.append({
+                "address": address,
+                "status": "created" if index in upserted else "updated",
+                "amount": balances.get(address),
+            })
 
-        return "success"
+        return _result
 
     async def get_balance(self, query_params: dict) -> dict:
         balance = await balance_collection.find_one(
-            filter={"address": query_params.get("address")}
+            filter={"address": query_params.get("address")},
+            with_cache=balance_collection.redis is not None and not balance_collection.expired(config.BALANCE_CACHE_TTL),
+            ttl=config.BALANCE_CACHE_TTL,
         )
 
         if not balance:
@@ -1,4 +1,7 @@
-from src.lib.exception import NotFound
+from pymongo.errors import DuplicateKeyError
+from src.config import config
+from src.lib.exception import NotFound, ConflictError
+from src.lib import serializer
 from src.models import nft_collection
 
 
@@ -7,14 +10,54 @@ class NFTHelper:
         pass
 
     async def add_nft(self, data: dict) -> str:
-        await nft_collection.insert_one(data)
+        try:
+            await nft_collection.insert_one(data, background=config.MONGO_WRITE_BEHIND)
+        except DuplicateKeyError:
+            raise ConflictError(msg="NFT already exists")
 
         return "success"
 
+    async def add_nft_batch(self, data: dict) -> dict:
+        items = data.get("items")
+        inserted, errors = await nft_collection.insert_many(
+            items, ordered=False, chunk_size=config.NFT_INSERT_CHUNK_SIZE
+        )
+
+        _result = []
+        for index, item in enumerate(items):
+            _item = {"address": item.get("address"), "nft_id": item.get("nft_id")}
+            if index in errors:
+                error = errors[index]
+                _item["status"] = "duplicate" if error.get("code") == 11000 else "failed"
+                if _item["status"] == "failed":
+                    _item["error"] = error.get("errmsg")
+            else:
+                _item["status"] = "inserted"
+            _result.append(_item)
+
+        return {
+            "inserted": len(inserted),
+            "duplicate": sum(1 for i in _result if i["status"] == "duplicate"),
+            "failed": sum(1 for i in _result if i["status"] == "failed"),
+            "items": _result,
+        }
+
     async def show_nft(self, query_params: dict) -> dict:
-        nft = await nft_collection.find(filter={"address": query_params.get("address")})
+        nft, next_cursor = await nft_collection.paginate(
+            filter={"address": query_params.get("address")},
+            after=query_params.get("after"),
+            limit=query_params.get("limit"),
+        )
 
-        if not nft:
+        if not nft and not query_params.get("after"):
             raise NotFound(errors="Not found address")
 
-        return nft
+        return {"items": nft, "next": next_cursor}
+
+    async def stream_nft(self, query_params: dict):
+        async for nft in nft_collection.stream(
+            filter={"address": query_params.get("address")},
+            after=query_params.get("after"),
+            batch_size=config.NFT_STREAM_BATCH_SIZE,
+        ):
+            yield serializer.dumps(nft) + b"\n"
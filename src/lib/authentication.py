@@ -4,63 +4,119 @@ from src.lib.enum import APIResponseCode, VARole
 from abc import ABC, abstractmethod
 from src.lib.logger import logger
 from src.lib.postgres import PostgresClient
+from src.lib.cache import LocalCache
+from src.lib import serializer
+from jwt.algorithms import get_default_algorithms
+import copy
 import datetime
+import hashlib
+import hmac
 import jwt
+import time
 import traceback
 
 
 
+class InvalidCredentials(Exception):
+    pass
+
+
 class Authorization(ABC):
 
+    label = "Authorization"
+    log_interval: float = 10
+    _failures = 0
+    _last_log = 0.0
+
     @abstractmethod
     def validate(self, request: Request, *arg, **kwargs):
         pass
 
+    def _log_failure(self, error: Exception):
+        # Rejected credentials are routine, report them at most once per interval.
+        self._failures += 1
+        _now = time.monotonic()
+        if _now - self._last_log < self.log_interval:
+            return
+        logger.warning(f"{self.label} validation failed {self._failures} time(s) since last report, "
+                       f"latest: {type(error).__name__}: {error}")
+        self._failures = 0
+        self._last_log = _now
+
 
 class JsonWebToken(Authorization):
-    def __init__(self, key, algorithm, *args, **kwargs) -> None:
+
+    label = "JWT"
+
+    def __init__(self, key, algorithm, public_key=None, cache_size: int = 10000, cache_ttl: float = 300,
+                 log_interval: float = 10, *args, **kwargs) -> None:
         super(JsonWebToken, self).__init__(*args, **kwargs)
         self.key = key
         self.algorithm = algorithm
+        _algorithm = get_default_algorithms()[algorithm]
+        self.signing_key = _algorithm.prepare_key(key)
+        if public_key is not None:
+            self.verify_key = _algorithm.prepare_key(public_key)
+        elif hasattr(self.signing_key, 'public_key'):
+            self.verify_key = self.signing_key.public_key()
+        else:
+            self.verify_key = self.signing_key
+        self.tokens = LocalCache(cache_size, cache_ttl, "jwt")
+        self.log_interval = log_interval
+        self._failures = 0
+        self._last_log = 0.0
 
     def create_token(self, payload_data, *arg, **kwargs): 
         token  = jwt.encode(payload={
             "payload": payload_data,
             "exp":datetime.datetime.utcnow() + datetime.timedelta(minutes=30)
-        }, key=self.key, algorithm=self.algorithm)
+        }, key=self.signing_key, algorithm=self.algorithm)
         refresh_token = jwt.encode(payload={
             "payload": payload_data,
             "exp":datetime.datetime.utcnow() + datetime.timedelta(days=1)
-        }, key=self.key, algorithm=self.algorithm)
+        }, key=self.signing_key, algorithm=self.algorithm)
         return {
             "token": token,
             "refresh_token": refresh_token
         }
 
+    def decode(self, token: str) -> dict:
+        _key = hashlib.sha256(token.encode()).digest()
+        _decode = self.tokens.get(_key)
+        if _decode is not None:
+            # callers receive the claims as `user`, never hand out the cached object
+            return copy.deepcopy(_decode)
+        _decode = jwt.decode(token, key=self.verify_key,
+                                algorithms=[self.algorithm])
+        _exp = _decode.get('exp')
+        _ttl = _exp - time.time() if _exp else None
+        if _ttl is None or _ttl > 0:
+            self.tokens.set(_key, _decode, ttl=_ttl)
+        return copy.deepcopy(_decode)
+
     def validate(self, request: Request, *arg, **kwargs):
         super(JsonWebToken, self).validate(request, *arg, **kwargs)
         try:
             _authorization = request.headers.get('authorization')
             if not _authorization:
-                raise
+                raise ValueError("missing authorization header")
             _type, _token = _authorization.split()
             if _type.lower() != 'bearer':
-                raise
-            _decode = jwt.decode(_token, key=self.key,
-                                    algorithms=[self.algorithm])
+                raise ValueError("authorization type is not bearer")
+            _decode = self.decode(_token)
             return _decode.get('payload')
-        except:
-            traceback.print_exc()
+        except Exception as e:
+            self._log_failure(e)
             raise Forbidden(code=APIResponseCode.OPT_EXPIRED.value["code"])
 
     def refresh_token(self, refresh_token):
         try: 
-            _decode = jwt.decode(refresh_token, key=self.key,
-                                    algorithms=self.algorithm)
+            _decode = jwt.decode(refresh_token, key=self.verify_key,
+                                    algorithms=[self.algorithm])
             token  = jwt.encode(payload={
                     "payload": _decode.get("payload"),
                     "exp":datetime.datetime.utcnow() + datetime.timedelta(minutes=30)
-                }, key=self.key, algorithm=self.algorithm)
+                }, key=self.signing_key, algorithm=self.algorithm)
             return token
         except: 
             raise Forbidden(code=APIResponseCode.FORBIDDEN.value["code"])
@@ -69,25 +125,82 @@ class JsonWebToken(Authorization):
 
 class APIKeyAuthen(Authorization):
 
-    def __init__(self) -> None:
+    label = "API key"
+
+    def __init__(self, cache_size: int = 10000, ttl: float = 60, negative_ttl: float = 5) -> None:
+        """
+        Validate the `authorization` header against the api key table.
+
+        Lookups go through an in-process cache and then the api key client's
+        Redis cache before hitting the database. Unknown keys are cached for
+        `negative_ttl` seconds so a client retrying a bad key does not cost a
+        query per request. Cached records never hold the plaintext key, only
+        its SHA-256 digest.
+        """
         super().__init__()
-    
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.keys = LocalCache(cache_size, ttl, "api_key")
+
+    @staticmethod
+    def _digest(api_key: str) -> str:
+        return hashlib.sha256(api_key.encode()).hexdigest()
+
+    async def lookup(self, api_db: PostgresClient, api_key: str, digest: str) -> dict:
+        _filter = {"api_key_hash": digest}
+        _key = api_db.get_key(_filter)
+        _data = self.keys.get(_key)
+        if _data is None and api_db.redis:
+            _cached = await api_db.get(_filter)
+            if _cached is not None:
+                _data = serializer.loads(_cached)
+                self.keys.set(_key, _data, ttl=self.ttl if _data else self.negative_ttl)
+        if _data is None:
+            _row = await api_db.find_one({"api_key": api_key}) or {}
+            _data = {k: v for k, v in _row.items() if k != "api_key"}
+            if _row:
+                _data["api_key_hash"] = self._digest(str(_row.get("api_key", "")))
+            _ttl = self.ttl if _data else self.negative_ttl
+            self.keys.set(_key, _data, ttl=_ttl)
+            if api_db.redis:
+                # unknown keys are left to their ttl, so key stuffing cannot grow the tracked key set
+                await api_db.set(_filter, _data, ttl=_ttl, track=bool(_data))
+        return dict(_data)
+
+    async def invalidate(self, api_db: PostgresClient, api_key: str) -> None:
+        """
+        Drop a key from every cache layer, e.g. after its `is_active` or
+        `is_delete` flag changed. Other workers evict it through the cache
+        invalidation channel.
+        """
+        _filter = {"api_key_hash": self._digest(api_key)}
+        self.keys.delete(api_db.get_key(_filter))
+        if api_db.redis:
+            await api_db.invalidate(_filter)
+
     async def validate(self, request: Request, *arg, **kwargs):
         try:
             api_db: PostgresClient = request.state._state.get("api_key")
             if api_db is None:
                 logger.error("api db not set")
                 raise
-            api_key = request.headers.get('authorization')
-            _data = await api_db.find_one({"api_key": api_key})
-            if not _data:
-                logger.error("===== error api_key =====")
-                logger.error(api_key)
-                logger.error(_data)
-                raise Exception()
+            api_key = request.headers.get('authorization') or ""
+            if not api_key:
+                raise InvalidCredentials("missing api key")
+            _digest = self._digest(api_key)
+            _data = await self.lookup(api_db, api_key, _digest)
+            if not _data or not hmac.compare_digest(str(_data.get("api_key_hash", "")), _digest):
+                raise InvalidCredentials(f"unknown api key {_digest[:8]}")
+            if not _data.get("is_active", True) or _data.get("is_delete", False):
+                raise InvalidCredentials(f"inactive api key {_digest[:8]}")
             if not VARole.check_role(_data.get("role")):
                 raise Forbidden(code=APIResponseCode.FORBIDDEN.value["code"], msg="Not found role")
             return _data
+        except Forbidden:
+            raise
+        except InvalidCredentials as e:
+            self._log_failure(e)
+            raise Forbidden(code=APIResponseCode.FORBIDDEN.value["code"])
         except:
             traceback.print_exc()
-            raise Forbidden(code=APIResponseCode.FORBIDDEN.value["code"])
\ No newline at end of file
+            raise Forbidden(code=APIResponseCode.FORBIDDEN.value["code"])
@@ -1,15 +1,84 @@
 from redis.asyncio import Redis, ConnectionPool
 from redis.asyncio.cluster import RedisCluster
-from typing import Dict, Any, Union
+from typing import Dict, Any, Hashable, Union, Optional, Tuple
 from urllib.parse import urlparse
+from collections import OrderedDict
 from src.lib.logger import logger
-import json
+from src.lib import serializer
+from src.lib import metrics
+import asyncio
+import time
 import traceback
+import weakref
+
+
+class LocalCache:
+    """
+    Bounded in-process LRU with a per-entry TTL, used as an L1 in front of Redis.
+    Entries evicted on other workers are dropped through the `channel` pub/sub
+    messages published by `Cache.invalidate`.
+    """
+
+    channel = "cache:invalidate"
+    instances = weakref.WeakSet()
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 1, name: str = "local") -> None:
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        LocalCache.instances.add(self)
+
+    def get(self, key: str) -> Any:
+        _entry = self.data.get(key)
+        if _entry is None:
+            self.miss()
+            return None
+        _value, _expire = _entry
+        if _expire < time.monotonic():
+            del self.data[key]
+            self.miss()
+            return None
+        self.data.move_to_end(key)
+        self.hits += 1
+        metrics.LOCAL_CACHE_REQUESTS.labels(self.name, "hit").inc()
+        return _value
+
+    def miss(self) -> None:
+        self.misses += 1
+        metrics.LOCAL_CACHE_REQUESTS.labels(self.name, "miss").inc()
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        _ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        self.data[key] = (value, time.monotonic() + _ttl)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def delete(self, *keys: str) -> None:
+        for key in keys:
+            self.data.pop(key, None)
+
+    def clear(self) -> None:
+        self.data.clear()
+
+    def stats(self) -> Dict:
+        return {
+            "name": self.name,
+            "size": len(self.data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
 
 class Cache:
 
-    def __init__(self, redis: Union[Redis, RedisCluster, None] = None) -> None:
+    def __init__(self, redis: Union[Redis, RedisCluster, None] = None, local: Optional[LocalCache] = None) -> None:
         self.redis = redis
+        self.local = local
         self.url = None
         self.kw = {}
     
@@ -18,17 +87,25 @@ class Cache:
         _class = cls(redis = None)
         _class.url = url
         _class.kw = kw
+        _class.redis = Redis(connection_pool=ConnectionPool.from_url(url = url, **kw))
         return _class
 
     async def connect(self):
-        pool = ConnectionPool.from_url(url = self.url, **self.kw)
-        redis = Redis(connection_pool=pool)
+        redis = self.redis
+        if redis is None:
+            pool = ConnectionPool.from_url(url = self.url, **self.kw)
+            redis = Redis(connection_pool=pool)
         parsed = urlparse(self.url)
         url_replaced = parsed._replace(netloc="{}:{}@{}:{}".format(parsed.username, "******", parsed.hostname, parsed.port))
         logger.debug(f"Redis connected: {url_replaced.geturl()}")
         await redis.ping()
         self.redis = redis
 
+    async def disconnect(self):
+        if self.redis:
+            await self.redis.close(close_connection_pool=True)
+            logger.debug("Redis disconnected")
+
     def get_key(self, filter: Dict) -> str:
         _keys = list(filter.keys())
         _keys.sort()
@@ -39,33 +116,111 @@ class Cache:
         _func = getattr(self.redis, function)
         return await _func(key, *args, **kwargs)
 
+    @staticmethod
+    def expired(ttl: float) -> bool:
+        """A ttl of -1 never expires; any other ttl that is not positive is not cached."""
+        return ttl != -1 and ttl <= 0
+
+    @metrics.observe("redis")
     async def set(self, filter: Dict, data: Any, ttl: float = -1) -> None:
+        if self.expired(ttl):
+            return
         _key = self.get_key(filter)
-        if isinstance(data, dict):
-            data = json.dumps(data)
+        if isinstance(data, dict) or isinstance(data, list):
+            data = serializer.dumps(data)
         if ttl == -1:
             await self.redis.set(_key, data)
         else:
-            await self.redis.set(_key, data, ex=ttl)
+            await self.redis.set(_key, data, px=int(ttl * 1000))
+        if self.local:
+            self.local.set(_key, data.decode() if isinstance(data, bytes) else str(data),
+                           ttl=None if ttl == -1 else ttl)
 
     async def get(self, filter: Dict) -> Any:
         if not self.redis:
             raise Exception()
         _key = self.get_key(filter)
-        data: bytes = await self.redis.get(_key)
-        return data.decode()
+        if self.local:
+            _data = self.local.get(_key)
+            if _data is not None:
+                return _data
+            data, _pttl = await self.redis_get_ttl(_key)
+        else:
+            data, _pttl = await self.redis_get(_key), -1
+        if data is None:
+            return None
+        data = data.decode()
+        if self.local:
+            # an L1 copy never outlives the Redis entry it was read from
+            self.local.set(_key, data, ttl=_pttl / 1000 if _pttl > 0 else None)
+        return data
+
+    @metrics.observe("redis", "get")
+    async def redis_get(self, key: str) -> Optional[bytes]:
+        return await self.redis.get(key)
+
+    @metrics.observe("redis", "get")
+    async def redis_get_ttl(self, key: str) -> Tuple[Optional[bytes], int]:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            return tuple(await pipe.get(key).pttl(key).execute())
+
+    async def invalidate(self, *filters: Dict) -> None:
+        await self.invalidate_keys(*[self.get_key(f) for f in filters])
 
-    async def hset(self, filter: Dict, hset_key: Any, data: Any) -> None:
+    @metrics.observe("redis")
+    async def invalidate_keys(self, *_keys: str) -> None:
+        if not self.redis or not _keys:
+            return
+        await self.redis.delete(*_keys)
+        if self.local:
+            self.local.delete(*_keys)
+        if LocalCache.instances:
+            await self.redis.publish(LocalCache.channel, serializer.dumps(_keys))
+
+    async def listen(self) -> None:
+        """
+        Evict keys invalidated by other workers from every `LocalCache` in this
+        process. Runs until cancelled; on a dropped subscription the local
+        caches are cleared since messages may have been missed.
+        """
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(LocalCache.channel)
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    _keys = serializer.loads(message.get("data"))
+                    for local in LocalCache.instances:
+                        local.delete(*_keys)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                traceback.print_exc()
+                for local in LocalCache.instances:
+                    local.clear()
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
+
+    @metrics.observe("redis")
+    async def hset(self, filter: Dict, hset_key: Any, data: Any, ttl: float = -1) -> None:
+        if self.expired(ttl):
+            return
         _key = self.get_key(filter)
         _hset_val = filter.get(hset_key)
         if isinstance(data, dict) or isinstance(data, list):
-            data = json.dumps(data)
+            data = serializer.dumps(data)
         await self.redis.hset(_key, str(_hset_val), data)
+        if ttl != -1:
+            await self.redis.pexpire(_key, int(ttl * 1000))
 
+    @metrics.observe("redis")
     async def hget(self, filter: Dict, hset_val: str):
         _key = self.get_key(filter)
         return await self.redis.hget(_key, hset_val)
 
+    @metrics.observe("redis")
     async def hget_all(self, filter: Dict):
         _key = self.get_key(filter)
         try:
@@ -73,3 +228,69 @@ class Cache:
         except:
             traceback.print_exc()
             return None
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls for the same key into one. The first caller runs
+    the call in its own task and publishes the outcome through a future that
+    later callers await, so a burst of identical reads costs a single database
+    round trip. Followers get shallow copies of the result so they can modify it
+    independently. If the leader is cancelled its followers run the call again.
+    """
+
+    _retry = object()
+
+    def __init__(self, client: str = "", enabled: bool = True) -> None:
+        self.client = client
+        self.enabled = enabled
+        self.calls: Dict[Hashable, asyncio.Future] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def copy(value: Any) -> Any:
+        if isinstance(value, dict):
+            return dict(value)
+        if isinstance(value, (list, tuple)):
+            return type(value)(SingleFlight.copy(i) for i in value)
+        return value
+
+    async def do(self, key: Optional[Hashable], func, *args, **kwargs) -> Any:
+        if not self.enabled or key is None:
+            return await func(*args, **kwargs)
+        _future = self.calls.get(key)
+        while _future is not None:
+            _result = await asyncio.shield(_future)
+            if _result is not self._retry:
+                self.coalesced += 1
+                metrics.COALESCED_CALLS.labels(self.client).inc()
+                return self.copy(_result)
+            _future = self.calls.get(key)
+
+        _future = asyncio.get_event_loop().create_future()
+        self.calls[key] = _future
+        self.executed += 1
+        try:
+            _result = await func(*args, **kwargs)
+        except Exception as e:
+            _future.set_exception(e)
+            # mark retrieved, the leader re-raises it and followers may not exist
+            _future.exception()
+            raise
+        except BaseException:
+            _future.set_result(self._retry)
+            raise
+        else:
+            _future.set_result(_result)
+            return _result
+        finally:
+            self.calls.pop(key, None)
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self.calls),
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+        }
@@ -45,6 +45,12 @@ class ConflictError(BaseException):
         super().__init__(msg, code, *args)
         self.status = 409
 
+class ServiceUnavailable(BaseException):
+    def __init__(self, msg="Service unavailable", errors={}, code=APIResponseCode.ERROR_NOT_IDENTIFIED.value["code"], *args: object) -> None:
+        super().__init__(msg, code, *args)
+        self.errors = errors
+        self.status = 503
+
 class InternalServer(BaseException):
     def __init__(self, msg="Internal server error", errors={}, code=APIResponseCode.INTERNAL_SERVER.value["code"], *args: object) -> None:
         super().__init__(msg, code, *args)
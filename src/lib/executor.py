@@ -6,13 +6,15 @@ from starlette.datastructures import UploadFile
 from src.lib.exception import BadRequest, BaseException as BE
 from src.lib.authentication import Authorization
 from src.lib.logger import logger
+from src.lib.profiler import profiler
+from src.lib import serializer
+from src.lib import metrics
 from pydantic import BaseModel
 from src.lib.enum import APIResponseCode
 
 import traceback
 import asyncio
-import json
-import tracemalloc
+import time
 
 def executor(
     login_require: Optional[Authorization] = None,
@@ -23,10 +25,15 @@ def executor(
     allow_roles = ['ALL']
 ):
     def _internal(f):
+        _code = f.__code__
+        _var_names = _code.co_varnames[:_code.co_argcount + _code.co_kwonlyargcount]
+        _is_coroutine = asyncio.iscoroutinefunction(f)
+        _validate_async = login_require is not None and asyncio.iscoroutinefunction(login_require.validate)
+
         @wraps(f)
         async def decorated(*args, **kwargs):
-            tracemalloc.start()
-
+            _start = time.perf_counter()
+            _status = 200
             _res = {
                 'data': '',
                 'msg': '',
@@ -41,7 +48,7 @@ def executor(
                 _kwargs['self'] = _self
 
                 if login_require:
-                    if asyncio.iscoroutinefunction(login_require.validate):
+                    if _validate_async:
                         _payload = await login_require.validate(_request)
                     else:
                         _payload = login_require.validate(_request)                       
@@ -56,21 +63,20 @@ def executor(
                 if query_params:
                     _params_data = _request.query_params._dict
                     try:
-                        _prams = query_params(**_params_data)
-                        
-                        _kwargs['query_params'] = json.loads(_prams.model_dump_json())
+                        _prams = query_params.model_validate(_params_data)
+                        _kwargs['query_params'] = _prams.model_dump(mode='json')
                     except Exception as e:
-                        raise BadRequest(errors=json.loads(e.json()), 
+                        raise BadRequest(errors=serializer.loads(e.json()), 
                                          code=APIResponseCode.FAIL_FORMAT.value["code"],
                                          msg=APIResponseCode.FAIL_FORMAT.value["detail"])
                     
                 if path_params:
                     _path_data = _request.path_params
                     try:
-                        _prams = path_params(**_path_data)
-                        _kwargs['path_params'] = json.loads(_prams.model_dump_json())
+                        _prams = path_params.model_validate(_path_data)
+                        _kwargs['path_params'] = _prams.model_dump(mode='json')
                     except Exception as e:
-                        raise BadRequest(errors=json.loads(
+                        raise BadRequest(errors=serializer.loads(
                             e.json()), code=APIResponseCode.FAIL_FORMAT.value["code"],
                             msg=APIResponseCode.FAIL_FORMAT.value["detail"])
 
@@ -82,11 +88,11 @@ def executor(
 
                     if _content_type == 'application/json':
                         try:
-                            _form_data = await _request.json()
-                            _data = form_data(**_form_data)
-                            _kwargs['form_data'] =json.loads(_data.model_dump_json())
+                            _body = await _request.body()
+                            _data = form_data.model_validate_json(_body)
+                            _kwargs['form_data'] = _data.model_dump(mode='json')
                         except Exception as e:
-                            raise BadRequest(errors=json.loads(
+                            raise BadRequest(errors=serializer.loads(
                                 e.json()), code=APIResponseCode.FAIL_FORMAT.value["code"],
                                 msg=APIResponseCode.FAIL_FORMAT.value["detail"])
 
@@ -99,27 +105,28 @@ def executor(
                                 else:
                                     _data[k] = v
                             try:
-                                _data = form_data(**_data)
-                                _kwargs['form_data'] = json.loads(_data.model_dump_json())
+                                _data = form_data.model_validate(_data)
+                                _kwargs['form_data'] = _data.model_dump(mode='json')
                             except Exception as e:
-                                raise BadRequest(errors=json.loads(
+                                raise BadRequest(errors=serializer.loads(
                                     e.json()), code=APIResponseCode.FAIL_FORMAT.value["code"],
                                     msg=APIResponseCode.FAIL_FORMAT.value["detail"])
                 function_var = {}
-                for var_name in f.__code__.co_varnames:
+                for var_name in _var_names:
                     if _kwargs.get(var_name):
                         function_var[var_name] = _kwargs[var_name]
-                if asyncio.iscoroutinefunction(f):
+                if _is_coroutine:
                     _response = await f(**function_var)
                 else:
                     _response = f(**function_var)
                 if isinstance(_response, Response):
+                    _status = _response.status_code
                     return _response
                 else:
                     _res['data'] = _response
                     _res['code'] = APIResponseCode.SUCCESS_CODE.value["code"]
                 return Response(
-                    content=json.dumps(_res),
+                    content=serializer.dumps(_res),
                     status_code=200,
                     headers={'Content-type': 'application/json'}
                 )
@@ -137,7 +144,18 @@ def executor(
                     _res['errors'] = str(e)
                     _status = 400
                     _res['code'] = APIResponseCode.NOT_FOUND.value["code"]
-                tracemalloc.stop()
-                return Response(json.dumps(_res), status_code=_status, headers=_exc_header)
-        return decorated
+                return Response(serializer.dumps(_res), status_code=_status, headers=_exc_header)
+            finally:
+                metrics.observe_request(f.__qualname__, _status, _res['code'], time.perf_counter() - _start)
+
+        @wraps(f)
+        async def profiled(*args, **kwargs):
+            if not profiler.sample():
+                return await decorated(*args, **kwargs)
+            _start = profiler.begin()
+            try:
+                return await decorated(*args, **kwargs)
+            finally:
+                profiler.record(f.__qualname__, _start)
+        return profiled
     return _internal
@@ -1,47 +1,269 @@
 import httpx
-from functools import wraps
-
-def process(func):
-    @wraps(func)
-    async def wrapper(*args, **kwargs):
-        args = list(args)
-        _url:str = ""
-        if len(args) > 1: 
-            _url = args[1]
-        else:
-            _url = kwargs.get("url")
-            args.append("")
-            del kwargs["url"]
-        if _url.startswith("/"):
-            _url = _url[1:]
-        args[1] = _url
-        _result = await func(*args, **kwargs)
-        return _result
-    return wrapper
+from src.lib import metrics
+from src.lib.exception import ServiceUnavailable
+from src.lib.logger import logger
+from typing import Dict, Optional
+from urllib.parse import urlparse
+import asyncio
+import random
+import time
+
+IDEMPOTENT_METHODS = ("GET", "PUT", "DELETE")
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures and rejects calls until
+    `reset_timeout` has passed, then lets a single probe through (half open).
+    """
+
+    def __init__(self, threshold: int = 5, reset_timeout: float = 30) -> None:
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = "half_open"
+        if self.probing:
+            return False
+        self.probing = True
+        return True
+
+    def release(self) -> None:
+        # A probe that ended without a verdict (e.g. cancelled) frees the slot.
+        if self.state == "half_open":
+            self.probing = False
+
+    def success(self) -> None:
+        self.state = "closed"
+        self.failures = 0
+        self.probing = False
+
+    def failure(self) -> bool:
+        self.failures += 1
+        self.probing = False
+        if self.state == "half_open" or self.failures >= self.threshold:
+            opened = self.state != "open"
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            return opened
+        return False
+
+
+class HostPolicy:
+
+    def __init__(self, host: str, concurrency: int, breaker: CircuitBreaker) -> None:
+        self.host = host
+        self.breaker = breaker
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.concurrency = concurrency
+        self.in_flight = 0
+        self.counters = {"requests": 0, "failures": 0, "retries": 0, "hedges": 0, "rejected": 0, "opened": 0}
+
+    def count(self, event: str) -> None:
+        self.counters[event] += 1
+        metrics.HTTP_CLIENT_EVENTS.labels(self.host, event).inc()
+
+    def stats(self) -> Dict:
+        return {
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "in_flight": self.in_flight,
+            "concurrency": self.concurrency,
+            **self.counters,
+        }
+
+
+class HttpClientPool:
+    """
+    Keeps one `httpx.AsyncClient` per base URL so every `AsyncHttpClient`
+    pointing at the same host reuses warm keep-alive connections, and one
+    `HostPolicy` per host for retries, hedging and circuit breaking.
+    """
+
+    def __init__(self) -> None:
+        self.clients: Dict[str, httpx.AsyncClient] = {}
+        self.policies: Dict[str, HostPolicy] = {}
+        self.limits = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30)
+        self.timeout = httpx.Timeout(10)
+        self.http2 = False
+        self.max_retries = 2
+        self.backoff_base = 0.1
+        self.backoff_max = 2
+        self.hedge_delay: Optional[float] = None
+        self.host_concurrency = 50
+        self.breaker_threshold = 5
+        self.breaker_reset = 30
+
+    def configure(self, max_connections: int = 100, max_keepalive_connections: int = 20,
+                  keepalive_expiry: float = 30, timeout: float = 10, http2: bool = False,
+                  max_retries: int = 2, backoff_base: float = 0.1, backoff_max: float = 2,
+                  hedge_delay: Optional[float] = None, host_concurrency: int = 50,
+                  breaker_threshold: int = 5, breaker_reset: float = 30) -> None:
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(timeout)
+        if http2:
+            try:
+                import h2
+            except ImportError:
+                logger.warning("HTTP/2 requested but h2 is not installed, using HTTP/1.1")
+                http2 = False
+        self.http2 = http2
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_delay = hedge_delay
+        self.host_concurrency = host_concurrency
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+
+    def get(self, base_url: str) -> httpx.AsyncClient:
+        client = self.clients.get(base_url)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                base_url=base_url,
+                limits=self.limits,
+                timeout=self.timeout,
+                http2=self.http2,
+            )
+            self.clients[base_url] = client
+        return client
+
+    def policy(self, base_url: str) -> HostPolicy:
+        host = urlparse(base_url).netloc
+        policy = self.policies.get(host)
+        if policy is None:
+            policy = HostPolicy(
+                host,
+                self.host_concurrency,
+                CircuitBreaker(self.breaker_threshold, self.breaker_reset),
+            )
+            self.policies[host] = policy
+        return policy
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def stats(self) -> Dict:
+        return {host: policy.stats() for host, policy in self.policies.items()}
+
+    async def close(self) -> None:
+        for client in self.clients.values():
+            await client.aclose()
+        self.clients.clear()
+
+
+http_pool = HttpClientPool()
 
 
 class AsyncHttpClient:
 
     def __init__(self, base_url: str) -> None:
-        self.client = httpx.AsyncClient()
         if not base_url.endswith('/'):
             base_url = base_url + '/'
-        self.base_url = httpx.URL(base_url)
+        self.base_url = base_url
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        return http_pool.get(self.base_url)
+
+    async def _hedged(self, policy: HostPolicy, method: str, url: str, **kwargs) -> httpx.Response:
+        first = asyncio.ensure_future(self.client.request(method, url, **kwargs))
+        tasks = {first}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=http_pool.hedge_delay)
+            if done:
+                return first.result()
+            policy.count("hedges")
+            tasks.add(asyncio.ensure_future(self.client.request(method, url, **kwargs)))
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
 
-    @process
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        policy = http_pool.policy(self.base_url)
+        attempts = http_pool.max_retries + 1 if method in IDEMPOTENT_METHODS else 1
+        url = url.lstrip('/')
+        async with policy.semaphore:
+            policy.in_flight += 1
+            try:
+                for attempt in range(attempts):
+                    if not policy.breaker.allow():
+                        policy.count("rejected")
+                        raise ServiceUnavailable(errors={"host": policy.host})
+                    policy.count("requests")
+                    _probe = policy.breaker.state == "half_open"
+                    try:
+                        try:
+                            if method == "GET" and http_pool.hedge_delay is not None:
+                                _response = await self._hedged(policy, method, url, **kwargs)
+                            else:
+                                _response = await self.client.request(method, url, **kwargs)
+                        except httpx.TransportError:
+                            if policy.breaker.failure():
+                                policy.count("opened")
+                            policy.count("failures")
+                            if attempt + 1 >= attempts:
+                                raise
+                        except Exception:
+                            if policy.breaker.failure():
+                                policy.count("opened")
+                            policy.count("failures")
+                            raise
+                        else:
+                            if _response.status_code < 500:
+                                policy.breaker.success()
+                                return _response
+                            if policy.breaker.failure():
+                                policy.count("opened")
+                            policy.count("failures")
+                            if attempt + 1 >= attempts:
+                                return _response
+                    finally:
+                        if _probe:
+                            policy.breaker.release()
+                    policy.count("retries")
+                    await asyncio.sleep(http_pool.backoff(attempt))
+            finally:
+                policy.in_flight -= 1
+
+    @metrics.observe("http")
     async def get(self, url, params={}, headers={}) -> httpx.Response:
-        _response = await self.client.get(self.base_url.join(url), params=params, headers=headers)
+        _response = await self._request("GET", url, params=params, headers=headers)
         return _response
 
-    @process
+    @metrics.observe("http")
     async def post(self, url, data={}, headers={}) -> httpx.Response: 
-        _response = await self.client.post(self.base_url.join(url), json=data, headers=headers)
+        _response = await self._request("POST", url, json=data, headers=headers)
         return _response
-    @process
+
+    @metrics.observe("http")
     async def put(self, url, data={}, headers={}) -> httpx.Response:
-        _response = await self.client.put(self.base_url.join(url), json=data, headers=headers)
+        _response = await self._request("PUT", url, json=data, headers=headers)
         return _response
-    @process
+
+    @metrics.observe("http")
     async def delete(self, url, data={}, headers={}) -> httpx.Response:
-        _response = await self.client.delete(self.base_url.join(url), json=data, headers=headers)
+        _response = await self._request("DELETE", url, json=data, headers=headers)
         return _response
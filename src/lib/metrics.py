@@ -0,0 +1,89 @@
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+from functools import wraps
+from typing import Optional
+import os
+import time
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+REQUEST_COUNT = Counter(
+    "http_requests_total",
+    "Requests handled by the executor",
+    ["route", "status", "code"],
+)
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Request latency measured by the executor",
+    ["route"],
+)
+CLIENT_LATENCY = Histogram(
+    "client_call_duration_seconds",
+    "Latency of Mongo, Postgres, Redis and HTTP client calls",
+    ["client", "operation"],
+)
+CLIENT_ERRORS = Counter(
+    "client_call_errors_total",
+    "Failed Mongo, Postgres, Redis and HTTP client calls",
+    ["client", "operation", "error"],
+)
+HTTP_CLIENT_EVENTS = Counter(
+    "http_client_events_total",
+    "Retries, hedges and circuit breaker events of AsyncHttpClient per host",
+    ["host", "event"],
+)
+COALESCED_CALLS = Counter(
+    "client_calls_coalesced_total",
+    "Reads answered by an identical in-flight call instead of a new query",
+    ["client"],
+)
+LOCAL_CACHE_REQUESTS = Counter(
+    "local_cache_requests_total",
+    "Lookups of the in-process LocalCache by result",
+    ["cache", "result"],
+)
+POSTGRES_POOL = Gauge(
+    "postgres_pool_connections",
+    "Connections of the Postgres pool by state",
+    ["state"],
+    multiprocess_mode="livesum",
+)
+MONGO_POOL_WAIT = Histogram(
+    "mongo_pool_checkout_wait_seconds",
+    "Time spent waiting to check a connection out of the Mongo pool",
+    buckets=(.0001, .0005, .001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5),
+)
+
+
+def observe_request(route: str, status: int, code: str, duration: float) -> None:
+    REQUEST_COUNT.labels(route, str(status), code).inc()
+    REQUEST_LATENCY.labels(route).observe(duration)
+
+
+def observe(client: str, operation: Optional[str] = None):
+    def _internal(func):
+        _operation = operation or func.__name__
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            _start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                CLIENT_ERRORS.labels(client, _operation, type(e).__name__).inc()
+                raise
+            finally:
+                CLIENT_LATENCY.labels(client, _operation).observe(time.perf_counter() - _start)
+        return wrapper
+    return _internal
+
+
+def render() -> bytes:
+    """
+    Serialise the metrics of this process, or of every gunicorn worker when
+    PROMETHEUS_MULTIPROC_DIR is set.
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
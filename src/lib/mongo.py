@@ -1,100 +1,374 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, IndexModel, InsertOne, UpdateOne, UpdateMany, DeleteOne, DeleteMany, monitoring
+from pymongo.errors import BulkWriteError, ConnectionFailure, DuplicateKeyError, OperationFailure, PyMongoError
 from redis.asyncio import Redis
 from redis.asyncio.cluster import RedisCluster
+import bson
 from bson import ObjectId
-from typing import Optional, Dict, Union, List
-from src.lib.cache import Cache
-from starlette.background import BackgroundTask
+from bson.errors import InvalidDocument
+from bson.codec_options import CodecOptions, DatetimeConversion, TypeDecoder, TypeRegistry
+from bson.datetime_ms import DatetimeMS
+from typing import Any, Optional, Dict, Union, List
+from src.lib.cache import Cache, SingleFlight
+from src.lib.logger import logger
+from src.lib import serializer
+from src.lib import metrics
 from datetime import datetime, timezone
 from urllib.parse import urlparse
-from functools import wraps
-from bson import ObjectId
-import copy
+import asyncio
+import threading
+import time
+import traceback
 
 def current_time():
     return datetime.now(tz=timezone.utc)
 
-def deserialize(func):
-    @wraps(func)
-    async def wrapper(*args, **kwargs):
-        _result = await func(*args, **kwargs)
-        if not _result:
-            return _result
-        def formater(data:dict):
-            for k, v in data.copy().items():
-                if isinstance(v, ObjectId):
-                    data[k] = str(v)
-                elif isinstance(v, datetime):
-                    data[k] = int(v.timestamp())
-            return data
-        if isinstance(_result, list):
-            _result = list(map(formater, _result))
-        else:
-            _result = formater(_result)
-        return _result
-    return wrapper
+def stamp(data: Dict, now: Optional[datetime] = None) -> Dict:
+    _now = now or current_time()
+    data.setdefault('created_at', _now)
+    data.setdefault('updated_at', _now)
+    return data
+
+def increment_query(data: Dict) -> Dict:
+    _now = current_time()
+    return {
+        '$inc': data,
+        '$set': {'updated_at': _now},
+        '$setOnInsert': {'created_at': _now},
+    }
+
+class ObjectIdDecoder(TypeDecoder):
+    bson_type = ObjectId
+
+    def transform_bson(self, value):
+        return str(value)
+
+class DatetimeDecoder(TypeDecoder):
+    bson_type = DatetimeMS
+
+    def transform_bson(self, value):
+        return int(value) // 1000
+
+wire_codec_options = CodecOptions(
+    datetime_conversion=DatetimeConversion.DATETIME_MS,
+    type_registry=TypeRegistry([ObjectIdDecoder(), DatetimeDecoder()]),
+)
+
+flights = SingleFlight("mongo")
+
+
+class WriteBehindQueue:
+    """
+    Deferred writes of one collection. Writes are queued and flushed as a single
+    ordered bulk_write once `batch_size` writes are waiting or `interval`
+    seconds after the first one, whichever comes first. Consecutive `$set`
+    updates or `$inc` increments on the same filter are merged into one write.
+    `put` blocks while `max_size` writes are pending, which pushes back on
+    callers when Mongo falls behind.
+    """
+
+    def __init__(self, dao: "MongoCollection", max_size: int = 10000, batch_size: int = 500, interval: float = 0.05,
+                 max_retries: int = 5, backoff_base: float = 0.1, backoff_max: float = 5) -> None:
+        self.dao = dao
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.queue: Optional[asyncio.Queue] = None
+        self.ready: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+        self.retried = 0
+
+    def start(self) -> None:
+        if self.queue is None:
+            self.queue = asyncio.Queue(self.max_size)
+            self.ready = asyncio.Event()
+        self.task = asyncio.ensure_future(self.run())
+
+    async def put(self, *write) -> None:
+        if self.task is None or self.task.done():
+            self.start()
+        await self.queue.put(write)
+        self.enqueued += 1
+        if self.queue.qsize() >= self.batch_size:
+            self.ready.set()
+
+    async def run(self) -> None:
+        while True:
+            _batch = [await self.queue.get()]
+            try:
+                try:
+                    await asyncio.wait_for(self.ready.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+                self.ready.clear()
+                while len(_batch) < self.batch_size and not self.queue.empty():
+                    _batch.append(self.queue.get_nowait())
+                if self.queue.qsize() >= self.batch_size:
+                    self.ready.set()
+                await self.flush(_batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Never let the consumer die, callers would block on a full queue.
+                traceback.print_exc()
+                self.failed += len(_batch)
+            finally:
+                for _ in _batch:
+                    self.queue.task_done()
+
+    @staticmethod
+    def coalesce(batch: List[tuple]) -> List:
+        _merged: List[list] = []
+        for op, filter, data, upsert in batch:
+            _last = _merged[-1] if _merged else None
+            if _last and op in ('update', 'increment') and _last[0] == op and _last[1] == filter and _last[3] == upsert:
+                if op == 'update':
+                    _last[2] = {**_last[2], **data}
+                else:
+                    _last[2] = {k: _last[2].get(k, 0) + data.get(k, 0) for k in {**_last[2], **data}}
+                continue
+            _merged.append([op, filter, data, upsert])
+        _requests = []
+        for op, filter, data, upsert in _merged:
+            if op == 'insert':
+                _requests.append(InsertOne(data))
+            elif op == 'update':
+                _requests.append(UpdateMany(filter, {'$set': data}, upsert=upsert))
+            elif op == 'increment':
+                _requests.append(UpdateOne(filter, increment_query(data), upsert=upsert))
+            elif op == 'delete_one':
+                _requests.append(DeleteOne(filter))
+            elif op == 'delete_many':
+                _requests.append(DeleteMany(filter))
+        return _requests
+
+    @staticmethod
+    def transient(error: Exception) -> bool:
+        if isinstance(error, ConnectionFailure):
+            return True
+        return isinstance(error, PyMongoError) and error.has_error_label("RetryableWriteError")
+
+    async def flush(self, batch: List[tuple]) -> None:
+        """
+        Write a batch, skipping writes rejected by the server and retrying the
+        remaining ones on transient errors with exponential backoff. After
+        `max_retries` attempts the rest of the batch is dropped and logged.
+        A batch interrupted by a network error may have been partly applied, so
+        a retry can replay inserts (rejected as duplicates) and increments;
+        the driver's retryable writes cover the common single-retry case.
+        """
+        _requests = self.coalesce(batch)
+        _name = self.dao.collection.name
+        self.batches += 1
+        _attempt = 0
+        while _requests:
+            try:
+                await self.dao.bulk_write(_requests, ordered=True)
+                self.written += len(_requests)
+                return
+            except BulkWriteError as e:
+                for _error in e.details.get("writeConcernErrors") or []:
+                    logger.warning(f"Write-behind on {_name} write concern error: {_error.get('errmsg')}")
+                _errors = e.details.get("writeErrors") or []
+                if not _errors:
+                    self.written += len(_requests)
+                    return
+                _index = _errors[0].get("index", len(_requests) - 1)
+                logger.error(f"Write-behind on {_name} failed: {_errors[0].get('errmsg')}")
+                self.written += _index
+                self.failed += 1
+                _requests = _requests[_index + 1:]
+            except Exception as e:
+                if not self.transient(e) or _attempt >= self.max_retries:
+                    logger.error(f"Write-behind on {_name} dropped {len(_requests)} writes: {e!r}")
+                    self.failed += len(_requests)
+                    return
+                _delay = min(self.backoff_max, self.backoff_base * 2 ** _attempt)
+                _attempt += 1
+                self.retried += 1
+                logger.warning(f"Write-behind on {_name} retry {_attempt} in {_delay:.2f}s: {e!r}")
+                await asyncio.sleep(_delay)
+
+    async def drain(self) -> None:
+        if self.task is None:
+            return
+        self.ready.set()
+        await self.queue.join()
+        self.task.cancel()
+        self.task = None
+
+    def stats(self) -> Dict:
+        return {
+            "pending": self.queue.qsize() if self.queue else 0,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "batches": self.batches,
+            "failed": self.failed,
+            "retried": self.retried,
+        }
+
 
 class MongoCollection(Cache):
 
-    def __init__(self, collection, prefix_key: str = "", redis: Union[Redis, RedisCluster, None ] = None, *args, **kwargs) -> None:
+    version_ttl = 60
+
+    def __init__(self, collection, prefix_key: str = "", redis: Union[Redis, RedisCluster, None ] = None, write_behind: Dict = {}, *args, **kwargs) -> None:
         super(MongoCollection, self).__init__(redis, *args, **kwargs)
         self.collection = collection
         self.prefix_key = prefix_key
         self.redis = redis
+        self.writes = WriteBehindQueue(self, **write_behind)
 
     def get_key(self, filter: Dict) -> str:
         return self.prefix_key+':'+super().get_key(filter)
 
-    @deserialize
-    async def find_one(self, filter: Dict, projection: Dict = {}, with_cache=False):
+    def version_key(self, key: str) -> str:
+        return f'{key}:version'
+
+    async def version(self, filter: Dict) -> int:
+        return int(await self.redis.get(self.version_key(self.get_key(filter))) or 0)
+
+    async def invalidate_keys(self, *_keys: str) -> None:
+        """
+        Bump the version of each key before dropping it, so a load that read the document before
+        the write does not cache it afterwards. Versions expire after `version_ttl` seconds, longer
+        than any load is expected to take.
+        """
+        if self.redis and _keys:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                for key in _keys:
+                    pipe.incr(self.version_key(key))
+                    pipe.pexpire(self.version_key(key), int(self.version_ttl * 1000))
+                await pipe.execute()
+        await super().invalidate_keys(*_keys)
+
+    async def cache_result(self, version: int, filter: Dict, data: Any, ttl: float = -1) -> None:
+        """
+        Cache `data` loaded while `filter` was at `version`. Skipped when the key was invalidated
+        since the load started, and dropped again if that happened while it was being written.
+        """
+        if await self.version(filter) != version:
+            return
+        await self.set(filter, data, ttl=ttl)
+        if await self.version(filter) != version:
+            await self.invalidate(filter)
+
+    async def find_one(self, filter: Dict, projection: Dict = {}, with_cache=False, ttl: float = -1):
         if with_cache:
             assert self.redis, "Redis not set"
-            _key = self.get_key(filter)
-            _data = self.redis.get(_key)
-            return _data
-        item = await self.collection.find_one(filter=filter, projection=projection)
-        return item
+            _data = await self.get(filter)
+            if _data is not None:
+                return serializer.loads(_data)
+
+        async def load():
+            _version = await self.version(filter) if with_cache else 0
+            item = await self._find_one(filter, projection)
+            if with_cache and item:
+                await self.cache_result(_version, filter, item, ttl=ttl)
+            return item
+        return await flights.do(self.flight_key("find_one", filter, projection, with_cache), load)
+
+    @metrics.observe("mongo", "find_one")
+    async def _find_one(self, filter: Dict, projection: Dict):
+        return await self.collection.find_one(filter=filter, projection=projection)
 
-    @deserialize
     async def find(self, filter: Dict, projection: Dict = {}, sort: Optional[bool] = True, limit: Optional[Union[int, None]] = None, skip: Optional[int] = 0,with_cache: Optional[bool] = False):
         sort_type = 1
         if not sort: sort_type = -1
-        students = await self.collection.find(filter=filter, projection=projection).sort('created_at', sort_type).skip(skip).to_list(limit)
-        return students
 
+        @metrics.observe("mongo", "find")
+        async def load():
+            return await self.collection.find(filter=filter, projection=projection).sort('created_at', sort_type).skip(skip).to_list(limit)
+        return await flights.do(self.flight_key("find", filter, projection, sort_type, limit, skip), load)
+
+    def flight_key(self, *args) -> Optional[tuple]:
+        # BSON keeps ObjectId, str and datetime apart, unlike the JSON serializer.
+        try:
+            return self.collection.full_name, bson.encode({'q': list(args)})
+        except (InvalidDocument, TypeError):
+            return None
+
+    def keyset(self, filter: Dict, after: Optional[str] = None, sort: Optional[bool] = True) -> Dict:
+        if not after:
+            return filter
+        _op = '$gt' if sort else '$lt'
+        return {'$and': [filter, {'_id': {_op: ObjectId(after)}}]}
+
+    async def paginate(self, filter: Dict, after: Optional[str] = None, limit: int = 100, projection: Optional[Dict] = None, sort: Optional[bool] = True):
+        sort_type = 1
+        if not sort: sort_type = -1
+        _filter = self.keyset(filter, after, sort)
+
+        @metrics.observe("mongo", "paginate")
+        async def load():
+            return await self.collection.find(filter=_filter, projection=projection).sort('_id', sort_type).limit(limit).to_list(limit)
+        items = await flights.do(self.flight_key("paginate", _filter, projection, sort_type, limit), load)
+        _next = str(items[-1]['_id']) if len(items) == limit else None
+        return items, _next
+
+    async def stream(self, filter: Dict, after: Optional[str] = None, projection: Optional[Dict] = None, sort: Optional[bool] = True, batch_size: int = 500):
+        sort_type = 1
+        if not sort: sort_type = -1
+        _filter = self.keyset(filter, after, sort)
+        cursor = self.collection.find(filter=_filter, projection=projection).sort('_id', sort_type).batch_size(batch_size)
+        async for item in cursor:
+            yield item
+
+    @metrics.observe("mongo")
     async def insert_one(self, data: Dict, background: bool = False):
-        _keys = list(data.keys())
-        if 'created_at' not in _keys:
-            data['created_at'] = current_time()
-        if 'updated_at' not in _keys:
-            data['updated_at'] = current_time()
-        _data = copy.deepcopy(data)
-        async def func():
-            return await self.collection.insert_one(_data)
+        _data = stamp(dict(data))
         if background:
-            await BackgroundTask(func)()
+            await self.writes.put('insert', None, _data, False)
             return True
-        return await func()
+        return await self.collection.insert_one(_data)
     
-    async def insert_many(self, data: List[Dict], background: bool = False):
-        async def func():
-            return await self.collection.insert_many(data)
+    @metrics.observe("mongo")
+    async def insert_many(self, data: List[Dict], ordered: bool = False, chunk_size: int = 1000, background: bool = False):
+        """
+        Insert `data` in chunks of `chunk_size`, stamping the documents in place.
+        Returns the inserted indexes and the write errors keyed by their index in
+        `data`; with `ordered=False` a failed document does not stop the others.
+        """
+        _now = current_time()
+        for item in data:
+            stamp(item, _now)
         if background:
-            await BackgroundTask(func)()
+            for item in data:
+                await self.writes.put('insert', None, item, False)
             return True
+        async def func():
+            inserted, errors = [], {}
+            for start in range(0, len(data), chunk_size):
+                chunk = data[start:start + chunk_size]
+                try:
+                    await self.collection.insert_many(chunk, ordered=ordered)
+                    inserted.extend(range(start, start + len(chunk)))
+                except BulkWriteError as e:
+                    _errors = {start + i.get("index"): i for i in e.details.get("writeErrors", [])}
+                    errors.update(_errors)
+                    _done = len(chunk) if not ordered else min(_errors) - start
+                    inserted.extend(i for i in range(start, start + _done) if i not in _errors)
+                    if ordered:
+                        break
+            return inserted, errors
         return await func()
 
+    @metrics.observe("mongo")
     async def delete_by_id(self, id: str, background: Optional[bool] = False):
-        async def func():
-            if not isinstance(id, ObjectId):
-                _id = ObjectId(id)
-            return await self.collection.delete_one({'_id': _id})
         if background:
-            await BackgroundTask(func)()
+            await self.writes.put('delete_one', {'_id': ObjectId(id)}, None, False)
             return True
         delete_result = await self.collection.delete_one({"_id": ObjectId(id)})
         return delete_result
 
+    @metrics.observe("mongo")
     async def delete_many(self, filter: Dict, background: Optional[bool] = False):
         async def func():
             if '_id' in filter.keys():
@@ -103,22 +377,27 @@ class MongoCollection(Cache):
                     filter['_id'] = str(_id)
             return await self.collection.delete_many(filter)
         if background:
-            await BackgroundTask(func)()
+            await self.writes.put('delete_many', filter, None, False)
             return True
         return await func()
 
+    @metrics.observe("mongo")
     async def delete_one(self, filter:Dict, background: bool = False):
         async def func():
             return await self.collection.delete_one(filter)
         if background:
-            await BackgroundTask(func)()
+            await self.writes.put('delete_one', filter, None, False)
             return True
         return func()
 
+    @metrics.observe("mongo")
     async def update(self, filter: Dict, data: Dict, background: Optional[bool] = False):
         _keys = list(data.keys())
         if 'updated_at' not in _keys:
             data['updated_at'] = current_time()
+        if background:
+            await self.writes.put('update', filter, data, False)
+            return True
         data = {'$set': data}
         async def func():
             if '_id' in filter.keys():
@@ -127,15 +406,33 @@ class MongoCollection(Cache):
                     filter['_id'] = str(_id)
             await self.collection.update_many(filter=filter, update=data)
 
+        return await func()
+
+    @metrics.observe("mongo")
+    async def find_one_and_update(self, filter: Dict, data: Dict, projection: Optional[Dict] = None, upsert: bool = False):
+        return await self.collection.find_one_and_update(
+            filter=filter,
+            update=data,
+            projection=projection,
+            upsert=upsert,
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def increment(self, filter: Dict, data: Dict, projection: Optional[Dict] = None, upsert: bool = True, background: bool = False):
         if background:
-            await BackgroundTask(func)()
+            await self.writes.put('increment', filter, data, upsert)
             return True
+        return await self.find_one_and_update(filter=filter, data=increment_query(data), projection=projection, upsert=upsert)
 
-        return await func()
+    @metrics.observe("mongo")
+    async def bulk_write(self, requests: List, ordered: bool = False):
+        return await self.collection.bulk_write(requests, ordered=ordered)
 
+    @metrics.observe("mongo")
     async def count(self, filter:Dict) -> int:
         return await self.collection.count_documents(filter)
 
+    @metrics.observe("mongo")
     async def create_index(self, index_models: List[tuple], index_name):
         existing_indexes = await self.collection.index_information()         
         if index_name in existing_indexes:
@@ -144,29 +441,167 @@ class MongoCollection(Cache):
 
 
 
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """
+    Tracks how long operations wait to check a connection out of the pool.
+    Checkouts run on Motor's executor threads, so start times are kept per
+    thread and counters are updated under a lock.
+    """
+
+    def __init__(self) -> None:
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.failed = 0
+        self.checked_out = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _wait(self) -> float:
+        _start = getattr(self._local, "start", None)
+        if _start is None:
+            return 0.0
+        self._local.start = None
+        return time.perf_counter() - _start
+
+    def connection_check_out_started(self, event):
+        self._local.start = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        _wait = self._wait()
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.wait_total += _wait
+            self.wait_max = max(self.wait_max, _wait)
+        metrics.MONGO_POOL_WAIT.observe(_wait)
+
+    def connection_check_out_failed(self, event):
+        self._wait()
+        with self._lock:
+            self.failed += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def stats(self) -> Dict:
+        return {
+            "checkouts": self.checkouts,
+            "failed": self.failed,
+            "checked_out": self.checked_out,
+            "wait_avg_ms": self.wait_total / self.checkouts * 1000 if self.checkouts else 0,
+            "wait_max_ms": self.wait_max * 1000,
+        }
+
+
 class MongoClient:
 
-    def __init__(self, uri: str, db_name:Optional[str]=None, *args, **kwargs):
+    def __init__(self, uri: str, db_name:Optional[str]=None, config: Dict = {}, write_behind: Dict = {}, *args, **kwargs):
         super(MongoClient, self).__init__(*args, **kwargs)
+        self.write_behind = write_behind
         url_parts = urlparse(uri)
         url_db = url_parts.path.strip("/")
-        self.client = self.connect(uri)
-        if not db_name and not url_db:
-            self.database = None
-        else:
-            self.database = self.get_database(db_name if db_name else url_db)
+        self.uri = uri
+        self.db_name = db_name if db_name else url_db
+        self.config = config
+        self.client = None
+        self.database = None
+        self.collections: List[tuple] = []
+        self.indexes: Dict[str, List[IndexModel]] = {}
+        self.pool_monitor = PoolMonitor()
 
-    def connect(self, mongo_uri: str, config: dict = {}):
-        client = AsyncIOMotorClient(mongo_uri, **config)
-        return client
+    def connect(self):
+        if self.client is not None:
+            return self.client
+        self.client = AsyncIOMotorClient(self.uri, event_listeners=[self.pool_monitor], **self.config)
+        if self.db_name:
+            self.set_database(self.db_name)
+        logger.debug(f"Mongo client created for database: {self.db_name}")
+        return self.client
+
+    def disconnect(self):
+        if self.client is None:
+            return
+        self.client.close()
+        self.client = None
+        self.database = None
+        logger.debug("Mongo disconnected")
 
     def get_database(self, name):
         return self.client.get_database(name)
     
     def set_database(self, name):
         self.database = self.client.get_database(name)
+        for name, dao in self.collections:
+            dao.collection = self.database.get_collection(name, codec_options=wire_codec_options)
 
-    def collection(self, name, config: Dict={}) -> MongoCollection:
-        col = self.database[name]
-        dao = MongoCollection(col, **config)
+    def collection(self, name, config: Dict={}, indexes: Optional[List[IndexModel]] = None) -> MongoCollection:
+        col = None
+        if self.database is not None:
+            col = self.database.get_collection(name, codec_options=wire_codec_options)
+        if indexes:
+            self.indexes.setdefault(name, []).extend(indexes)
+        dao = MongoCollection(col, write_behind=self.write_behind, **config)
+        self.collections.append((name, dao))
         return dao
+
+    async def drain(self):
+        for name, dao in self.collections:
+            await dao.writes.drain()
+
+    def write_stats(self) -> Dict:
+        return {name: dao.writes.stats() for name, dao in self.collections}
+
+    async def ensure_indexes(self) -> Dict[str, List[str]]:
+        # One createIndexes call per index, so a unique index that cannot be
+        # built does not keep the other indexes of the collection from existing.
+        failed = {}
+        for name, index_models in self.indexes.items():
+            for index_model in index_models:
+                _index = index_model.document['name']
+                try:
+                    await self.database[name].create_indexes([index_model])
+                    logger.debug(f"Index ensured on {name}: {_index}")
+                except DuplicateKeyError as e:
+                    _keys = ', '.join(index_model.document['key'].keys())
+                    logger.error(
+                        f"Unique index {_index} on {name} not created: documents share the same ({_keys}), "
+                        f"remove the duplicates and restart. {e.details.get('errmsg') if e.details else e}"
+                    )
+                    failed.setdefault(name, []).append(_index)
+                except OperationFailure as e:
+                    logger.error(f"Ensure index {_index} on {name} failed: {e}")
+                    failed.setdefault(name, []).append(_index)
+        return failed
+
+    async def check_indexes(self) -> Dict[str, List[str]]:
+        missing = {}
+        for name, index_models in self.indexes.items():
+            existing = await self.database[name].index_information()
+            _missing = [i.document['name'] for i in index_models if i.document['name'] not in existing]
+            if _missing:
+                logger.warning(f"Missing indexes on {name}: {', '.join(_missing)}")
+                missing[name] = _missing
+        return missing
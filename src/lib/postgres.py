@@ -7,21 +7,22 @@ from sqlalchemy.sql import func
 
 from redis.asyncio import Redis
 from redis.asyncio.cluster import RedisCluster
-from typing import Any, Dict, Type, Union
+from typing import Any, Dict, Optional, Type, Union
 from asyncio import current_task, Task
 from src.lib.exception import InternalServer
 from src.lib.logger import logger
-from src.lib.cache import Cache
+from src.lib.cache import Cache, SingleFlight
+from src.lib import serializer
+from src.lib import metrics
 from datetime import datetime, timezone
 from typing import List, Dict
 from urllib.parse import urlparse
-from functools import wraps
 from starlette.background import BackgroundTask
 from contextvars import ContextVar, Token
 from uuid import uuid4
 
+import time
 import traceback
-import json
 
 session_context: ContextVar[str] = ContextVar("session_context")
 
@@ -41,56 +42,127 @@ def current_time():
 Base = declarative_base()
 
 
-def deserialize(func):
+def format_row(data: dict, projection: List[str] = [], should_load_data: bool = True) -> dict:
     """
-    The `deserialize` function is a decorator that formats datetime objects in the result of an async
-    function to a specific string format.
-    
-    :param func: The `func` parameter is a function that will be decorated by the `deserialize`
-    decorator
-    :return: The `deserialize` function returns a decorated version of the input function `func`.
+    The `format_row` function formats datetime values of a row to a string and drops the deferred
+    `projection` columns when `should_load_data` is False. Rows are formatted before they are cached
+    so cached and freshly loaded results look the same.
     """
-    @wraps(func)
-    async def wrapper(*args, **kwargs):
-        _projection = kwargs.get('projection', [])
-        _should_load_data = kwargs.get('should_load_data', True)
-        _result = await func(*args, **kwargs)
-        if not _result:
-            return _result
-        
-        def formatter(data: dict):
-            for key, value in data.copy().items():
-                if isinstance(value, datetime):
-                    data[key] = value.strftime('%Y-%m-%d %H:%M:%S')
-                if key in _projection and not _should_load_data:
-                    del data[key]
-            return data
-        if isinstance(_result, list):
-            _result = list(map(formatter, _result))
-        else:
-            _result = formatter(_result)
-        return _result
-    return wrapper
+    for key, value in data.copy().items():
+        if isinstance(value, datetime):
+            data[key] = value.strftime('%Y-%m-%d %H:%M:%S')
+        if key in projection and not should_load_data:
+            del data[key]
+    return data
 
 
 class PostgresClient(Cache):
 
+    flights = SingleFlight("postgres")
+    # seconds a tracked key is kept past its ttl, covering clock skew between workers
+    track_slack = 5
+
     def __init__(self, model: Type[Base], session: async_scoped_session, redis: Union[Redis, None] = None, *args, **kwargs) -> None:
         super(PostgresClient, self).__init__(redis, *args, **kwargs)
         self.model = model
         self.session = session
         self.redis = redis
         self._table_name = self.model.__tablename__
+        self._cache_keys = f'{self._table_name}:cache_index'
+        self._generation = f'{self._table_name}:generation'
 
     def get_key(self, filter: Dict) -> str:
         return f'{self._table_name}.{super().get_key(filter)}'
 
-    def cache_key(self, filter: Dict):
-        _key_items = [f'{k}:{v}' for k, v in filter.items()]
-        return f'{self._table_name}.{".".join(_key_items)}'
+    def cache_filter(self, filter: Dict, projection: List[str] = [], should_load_data: bool = True, **options) -> Dict:
+        """
+        The `cache_filter` function extends a filter with the query options that change its result, so
+        two queries only share a cache entry when they would return the same rows.
+        """
+        _filter = dict(filter)
+        if len(projection):
+            _filter['_projection'] = ','.join(projection)
+            _filter['_load'] = int(should_load_data)
+        for k, v in options.items():
+            if v:
+                _filter[f'_{k}'] = v
+        return _filter
+
+    async def generation(self) -> int:
+        return int(await self.redis.get(self._generation) or 0)
+
+    async def cache_result(self, generation: int, filter: Dict, write) -> None:
+        """
+        The `cache_result` function runs the cache `write` of a result loaded while the table was at
+        `generation`. It is skipped when the table was written to since the load started, and the
+        entry is dropped again if that happened while it was being written, so a row read before a
+        concurrent commit is never cached after that commit's invalidation.
+        """
+        if await self.generation() != generation:
+            return
+        await write()
+        if await self.generation() != generation:
+            await self.invalidate_keys(self.get_key(filter))
+
+    def flight_key(self, cache_filter: Optional[Dict], cache: bool) -> Optional[str]:
+        """
+        The `flight_key` function returns the key concurrent identical reads are coalesced under, or
+        None when the read must run on its own: `Select` filters, and sessions already inside a
+        transaction, which may hold uncommitted writes that other callers must not see or miss.
+        """
+        if cache_filter is None or not self.flights.enabled:
+            return None
+        _session = self.session() if isinstance(self.session, async_scoped_session) else self.session
+        if _session.in_transaction():
+            return None
+        return f'{self.get_key(cache_filter)}:{int(cache)}'
+
+    async def set(self, filter: Dict, data: Any, ttl: float = -1, track: bool = True) -> None:
+        """
+        The `set` function caches `data` and tracks its key for `invalidate_table`. Entries that must
+        not outlive a write to the table are tracked; pass `track=False` for short-lived entries, such
+        as negative lookups, that their ttl alone keeps fresh enough.
+        """
+        await super().set(filter, data, ttl=ttl)
+        if track:
+            await self.track(filter, ttl)
+
+    async def hset(self, filter: Dict, hset_key: Any, data: Any, ttl: float = -1) -> None:
+        await super().hset(filter, hset_key, data, ttl=ttl)
+        await self.track(filter, ttl)
+
+    async def track(self, filter: Dict, ttl: float = -1) -> None:
+        """
+        The `track` function records the key of a cached result for `invalidate_table`. Keys are scored
+        by when their entry expires and expired ones are pruned on every write, so keys of results
+        that expired on their own do not pile up between writes to the table.
+        """
+        if self.expired(ttl):
+            return
+        _now = time.time()
+        _expire_at = float("inf") if ttl == -1 else _now + ttl + self.track_slack
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(self._cache_keys, {self.get_key(filter): _expire_at})
+            pipe.zremrangebyscore(self._cache_keys, "-inf", _now)
+            await pipe.execute()
+
+    async def invalidate_table(self) -> None:
+        """
+        The `invalidate_table` function drops every cached result of this table. It is called after
+        each committed insert, update and delete since any cached query may be affected. The table
+        generation is bumped and the set of tracked keys is read and reset in one transaction, so
+        keys cached meanwhile stay tracked and loads that started earlier are not cached.
+        """
+        if not self.redis:
+            return
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                _, _keys, _ = await pipe.incr(self._generation).zrange(self._cache_keys, 0, -1).delete(self._cache_keys).execute()
+            await self.invalidate_keys(*[k.decode() if isinstance(k, bytes) else k for k in _keys])
+        except Exception:
+            traceback.print_exc()
 
-    @deserialize
-    async def find_one(self, filter: Union[Dict, Select], projection: List[str] = [], should_load_data: bool = True,from_cache: bool = False, cache: bool = False, *args, **kwargs) -> Dict:
+    async def find_one(self, filter: Union[Dict, Select], projection: List[str] = [], should_load_data: bool = True,from_cache: bool = False, cache: bool = False, ttl: float = -1, *args, **kwargs) -> Dict:
         """
         The `find_one` function retrieves a single document from a database based on a filter, with an
         option to retrieve from cache and store in cache.
@@ -112,46 +184,55 @@ class PostgresClient(Cache):
         query should be cached or not. If set to `True`, the result will be stored in the cache for
         future use. If set to `False`, the result will not be cached, defaults to False
         :type cache: bool (optional)
+        :param ttl: The `ttl` parameter is the lifetime in seconds of the cached result, -1 keeps it
+        until the table is written to, defaults to -1
+        :type ttl: float (optional)
         :return: The function `find_one` returns a dictionary.
         """
-        _result = None
-        if from_cache:
-            assert not isinstance(
-                filter, Select), "filter from cache must be dictionary"
-            _result = self.get(filter)
-        if not _result:
-            _query = None
-            if isinstance(filter, Select):
-                _query = filter.limit(1)
-            else:
-                _query = select(self.model).filter_by(**filter).limit(1)
-            if len(projection):
-                columns = [getattr(self.model, i) for i in projection]
-                _query = (
-                    _query.options(load_only(*columns)) if should_load_data
-                    else _query.options(*[defer(getattr(self.model, i)) for i in projection] )
-                )
-            _obj = await self.session.execute(_query)
-            _obj = _obj.scalars().fetchall()
-            if len(_obj) == 0:
-                return None
-            _obj = _obj[0]
-            if len(projection):
-                if should_load_data: _result = {c: getattr(_obj, c) for c in projection}
-                else:  _result = {k: v for (k, v) in _obj.__dict__.items()
-                                if k != '_sa_instance_state'}
-            else:
-                _result = _obj if not _obj else _obj.as_dict
-        else:
-            _result = json.loads(_result)
-        if cache:
+        if from_cache or cache:
             assert isinstance(
-                filter, dict), "filter save in cache must be dictionary. Select will be update in next version"
-            self.set(filter, _result, ttl=-1)
-        return _result
+                filter, dict), "filter from cache must be dictionary. Select will be update in next version"
+        _cache_filter = self.cache_filter(filter, projection, should_load_data) if isinstance(filter, dict) else None
+        if from_cache and self.redis:
+            _cached = await self.get(_cache_filter)
+            if _cached is not None:
+                return serializer.loads(_cached)
+
+        async def load():
+            _generation = await self.generation() if cache and self.redis else None
+            _result = await self._find_one(filter, projection, should_load_data)
+            if _generation is not None and _result is not None:
+                await self.cache_result(_generation, _cache_filter, lambda: self.set(_cache_filter, _result, ttl=ttl))
+            return _result
+        return await self.flights.do(self.flight_key(_cache_filter, cache), load)
+
+    @metrics.observe("postgres", "find_one")
+    async def _find_one(self, filter: Union[Dict, Select], projection: List[str], should_load_data: bool) -> Dict:
+        _query = None
+        if isinstance(filter, Select):
+            _query = filter.limit(1)
+        else:
+            _query = select(self.model).filter_by(**filter).limit(1)
+        if len(projection):
+            columns = [getattr(self.model, i) for i in projection]
+            _query = (
+                _query.options(load_only(*columns)) if should_load_data
+                else _query.options(*[defer(getattr(self.model, i)) for i in projection] )
+            )
+        _obj = await self.session.execute(_query)
+        _obj = _obj.scalars().fetchall()
+        if len(_obj) == 0:
+            return None
+        _obj = _obj[0]
+        if len(projection):
+            if should_load_data: _result = {c: getattr(_obj, c) for c in projection}
+            else:  _result = {k: v for (k, v) in _obj.__dict__.items()
+                            if k != '_sa_instance_state'}
+        else:
+            _result = _obj.as_dict
+        return format_row(_result, projection, should_load_data)
 
-    @deserialize
-    async def find(self, filter: Union[Dict[str, Any], Select], projection: List[str] = [], should_load_data: bool = True,limit: int = 0, skip: int = 0,from_cache: bool = False, hset_key: Union[str, None] = None, cache: bool = False, *args, **kwargs) -> List[Dict]:
+    async def find(self, filter: Union[Dict[str, Any], Select], projection: List[str] = [], should_load_data: bool = True,limit: int = 0, skip: int = 0,from_cache: bool = False, hset_key: Union[str, None] = None, cache: bool = False, ttl: float = -1, *args, **kwargs) -> List[Dict]:
         """
         The `find` function retrieves data from a cache or a database based on a filter, projection, and
         caching options, and returns the results as a list of dictionaries.
@@ -177,62 +258,147 @@ class PostgresClient(Cache):
         query should be cached or not. If set to `True`, the results will be cached using the `hset`
         method. If set to `False`, the results will not be cached, defaults to False
         :type cache: bool (optional)
+        :param ttl: The `ttl` parameter is the lifetime in seconds of the cached results, -1 keeps them
+        until the table is written to, defaults to -1
+        :type ttl: float (optional)
         :return: a list of dictionaries.
         """
-        _result = []
-        if from_cache:
+        if cache and not hset_key:
+            raise InternalServer(
+                errors={'hset_key': 'not provide with cache=True'})
+        if from_cache or cache:
             assert isinstance(
                 filter, dict), "filter from cache must be dictionary. Select object will be update next version"
-            _result = self.hget_all(filter)
-        if not _result:
-            _query = None
-            if isinstance(filter, Select):
-                _query = filter if limit == 0 else filter.limit(limit)
-                _query = _query if skip == 0 else _query.offset(skip)
-            else:
-                if limit == 0:
-                    _query = select(self.model).filter_by(**filter)
-                else: _query = select(self.model).filter_by(**filter).limit(limit)
-                if skip != 0:
-                    _query = _query.offset(skip)
-            if len(projection): 
-                columns = [getattr(self.model, i) for i in projection]
-                _query = (
-                    _query.options(load_only(*columns)) if should_load_data
-                    else _query.options(*[defer(getattr(self.model, i)) for i in projection] )
-                )
-            _obj = await self.session.execute(_query)
-            _obj = _obj.scalars().fetchall()
-            if len(projection):
-                if should_load_data:
-                    for o in _obj:
-                        _result.append({c: getattr(o, c) for c in projection})
-                else: 
-                    for item in _obj:
-                        item = {k: v for (k, v) in item.__dict__.items()
-                                if k != '_sa_instance_state'}
-                        _result.append(item)
-            else:
-                _result = [] if not _obj else [i.as_dict for i in _obj]
+        _cache_filter = self.cache_filter(filter, projection, should_load_data, many=1, limit=limit, skip=skip) if isinstance(filter, dict) else None
+        if from_cache and self.redis:
+            _cached = await self.hget_all(_cache_filter)
+            if _cached:
+                _result = []
+                for i in _cached.values():
+                    _result.extend(serializer.loads(i))
+                return _result
+
+        async def load():
+            _generation = await self.generation() if cache and self.redis else None
+            _result = await self._find(filter, projection, should_load_data, limit, skip)
+            if _generation is not None:
+                await self.cache_result(_generation, _cache_filter, lambda: self.hset(_cache_filter, hset_key, _result, ttl=ttl))
+            return _result
+        return await self.flights.do(self.flight_key(_cache_filter, cache), load)
+
+    @metrics.observe("postgres", "find")
+    async def _find(self, filter: Union[Dict[str, Any], Select], projection: List[str], should_load_data: bool, limit: int, skip: int) -> List[Dict]:
+        _result = []
+        _query = None
+        if isinstance(filter, Select):
+            _query = filter if limit == 0 else filter.limit(limit)
+            _query = _query if skip == 0 else _query.offset(skip)
         else:
-            _temp = [json.loads(i) for i in _result.values()]
-            _result = []
-            for i in _temp:
-                _result.extend(i)
-        if cache:
-            if not hset_key:
-                raise InternalServer(
-                    errors={'hset_key': 'not provide with cache=True'})
-            assert isinstance(
-                filter, dict), "filter save to cache must be dictionary. Select object will be udpated to next version"
-            self.hset(filter, hset_key, _result)
-        return _result
+            if limit == 0:
+                _query = select(self.model).filter_by(**filter)
+            else: _query = select(self.model).filter_by(**filter).limit(limit)
+            if skip != 0:
+                _query = _query.offset(skip)
+        if len(projection): 
+            columns = [getattr(self.model, i) for i in projection]
+            _query = (
+                _query.options(load_only(*columns)) if should_load_data
+                else _query.options(*[defer(getattr(self.model, i)) for i in projection] )
+            )
+        _obj = await self.session.execute(_query)
+        _obj = _obj.scalars().fetchall()
+        if len(projection):
+            if should_load_data:
+                for o in _obj:
+                    _result.append({c: getattr(o, c) for c in projection})
+            else: 
+                for item in _obj:
+                    item = {k: v for (k, v) in item.__dict__.items()
+                            if k != '_sa_instance_state'}
+                    _result.append(item)
+        else:
+            _result = [i.as_dict for i in _obj]
+        return [format_row(i, projection, should_load_data) for i in _result]
+
+    def _row_query(self, filter: Union[Dict[str, Any], Select], projection: List[str], limit: int, skip: int) -> Select:
+        _table = self.model.__table__
+        _columns = [_table.c[i] for i in projection] if len(projection) else list(_table.c)
+        if isinstance(filter, Select):
+            _query = filter
+            _descriptions = filter.column_descriptions
+            if any(i['expr'] is i['entity'] for i in _descriptions):
+                # rows of an entity select hold model instances, select the table columns instead
+                if len(_descriptions) != 1 or _descriptions[0]['entity'] is not self.model:
+                    raise InternalServer(
+                        errors={'filter': f'only select({self.model.__name__}) or a select of columns is supported'})
+                _query = filter.with_only_columns(*_columns)
+        else:
+            _query = select(*_columns).where(*[_table.c[k] == v for k, v in filter.items()])
+        if limit:
+            _query = _query.limit(limit)
+        if skip:
+            _query = _query.offset(skip)
+        return _query
+
+    @staticmethod
+    def _row_formatter(keys: List[str], columns, as_tuple: bool):
+        _dates = []
+        for index, column in enumerate(columns):
+            try:
+                if issubclass(column.type.python_type, datetime):
+                    _dates.append(index)
+            except (AttributeError, NotImplementedError):
+                pass
+
+        def formatter(row) -> Union[Dict, tuple]:
+            if _dates:
+                row = list(row)
+                for i in _dates:
+                    if row[i] is not None:
+                        row[i] = row[i].strftime('%Y-%m-%d %H:%M:%S')
+            return tuple(row) if as_tuple else dict(zip(keys, row))
+        return formatter
+
+    @metrics.observe("postgres")
+    async def find_rows(self, filter: Union[Dict[str, Any], Select], projection: List[str] = [], limit: int = 0, skip: int = 0, as_tuple: bool = False) -> List[Union[Dict, tuple]]:
+        """
+        The `find_rows` function is the ORM-free read path of `find`. It selects only the projected
+        columns of the table and builds plain rows without loading model instances, formatting
+        datetime columns in the same pass.
+        
+        :param filter: The `filter` parameter is either a dictionary of column equality conditions or a
+        `Select` built by the caller, of columns or of the model itself
+        :type filter: Union[Dict[str, Any], Select]
+        :param projection: The `projection` parameter is the list of column names to select, all
+        columns of the table when empty. It is ignored for a `Select` of columns
+        :type projection: List[str]
+        :param as_tuple: The `as_tuple` parameter returns each row as a tuple in column order instead
+        of a dictionary, defaults to False
+        :type as_tuple: bool (optional)
+        :return: a list of dictionaries or tuples.
+        """
+        _query = self._row_query(filter, projection, limit, skip)
+        _result = await self.session.execute(_query)
+        _format = self._row_formatter(list(_result.keys()), _query.selected_columns, as_tuple)
+        return [_format(row) for row in _result.all()]
+
+    async def stream_rows(self, filter: Union[Dict[str, Any], Select], projection: List[str] = [], as_tuple: bool = False, batch_size: int = 1000):
+        """
+        The `stream_rows` function yields the rows of `find_rows` in batches of `batch_size` from a
+        server side cursor, so large scans never hold the whole result in memory.
+        """
+        _query = self._row_query(filter, projection, 0, 0).execution_options(yield_per=batch_size)
+        _result = await self.session.stream(_query)
+        _format = self._row_formatter(list(_result.keys()), _query.selected_columns, as_tuple)
+        async for partition in _result.partitions():
+            yield [_format(row) for row in partition]
 
     async def _iud(self, _orm):
         _orm = _orm.returning(self.model.id)
         _result = await self.session.execute(_orm)
         return _result.all()
 
+    @metrics.observe("postgres")
     async def insert(self, data: Union[Dict, List[Dict], Insert], background: bool = False):
         """
         The `insert` function inserts data into a database table, and can be executed in the background
@@ -255,6 +421,7 @@ class PostgresClient(Cache):
         async def func():
             _res = await self._iud(_insert)
             await self.session.commit()
+            await self.invalidate_table()
             return _res
         if background:
             try:
@@ -265,6 +432,7 @@ class PostgresClient(Cache):
                 return False
         return await func()
 
+    @metrics.observe("postgres")
     async def update(self, filter: Union[Dict, Update], data: Dict, background: bool = False):
         """
         The `update` function updates a model with the given filter and data, and optionally runs the
@@ -291,6 +459,7 @@ class PostgresClient(Cache):
         async def func():
             _res = await self._iud(_update)
             await self.session.commit()
+            await self.invalidate_table()
             return _res
         if background:
             try:
@@ -301,6 +470,7 @@ class PostgresClient(Cache):
                 return False
         return await func()
 
+    @metrics.observe("postgres")
     async def delete(self, filter: Union[Dict, Delete], background: bool = False):
         """
         The `delete` function deletes records from a database table based on a given filter, and can be
@@ -325,6 +495,7 @@ class PostgresClient(Cache):
         async def func():
             _res = await self._iud(_delete)
             await self.session.commit()
+            await self.invalidate_table()
             return _res
         if background:
             try:
@@ -335,6 +506,7 @@ class PostgresClient(Cache):
                 return False
         return await func()
     
+    @metrics.observe("postgres")
     async def count(self, filter: Union[Dict, Select]) -> int:
         """
         The `count` function returns the number of records that match a given filter.
@@ -392,16 +564,60 @@ class Postgres:
             logger.warning("connection is created")
     
     async def disconnect(self):
-        await self.session.close()
         await self.engine.dispose()
+        Postgres.engine = None
         logger.debug(f"Database disconnected")
 
     def make_session(self, options: dict = {}, scope = None):
         options.setdefault("class_", AsyncSession)
         options.setdefault("query_cls", Query)
         factory = async_sessionmaker(bind=Postgres.engine, **options)
-        self.session = async_scoped_session(factory, self.__current_task if not scope else scope)()
+        self.session = async_scoped_session(factory, self.__current_task if not scope else scope)
+
+    def pool_stats(self) -> Dict:
+        """
+        The `pool_stats` function reports the occupancy of the engine's connection pool so
+        `pool_size` and `max_overflow` can be tuned from real load.
+        """
+        if self.engine is None:
+            return {}
+        pool = self.engine.pool
+        if not hasattr(pool, "checkedout"):
+            return {"status": pool.status()}
+        return {
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+        }
 
     async def create_all(self):
         async with self.engine.begin() as conn:
             await conn.run_sync(self.Model.metadata.create_all)
+
+
+class SessionMiddleware:
+    """
+    ASGI middleware giving every request its own session scope. Sessions made with
+    `make_session(scope=get_session_context)` are created lazily on first use and are
+    closed at the end of the response, which rolls back anything uncommitted and
+    returns the connection to the pool.
+    """
+
+    def __init__(self, app, database: Postgres) -> None:
+        self.app = app
+        self.database = database
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+        _context = set_session_context()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if self.database.session.registry.has():
+                await self.database.session.remove()
+            session_context.reset(_context)
+            for state, value in self.database.pool_stats().items():
+                if isinstance(value, int):
+                    metrics.POSTGRES_POOL.labels(state).set(value)
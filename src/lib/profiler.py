@@ -0,0 +1,91 @@
+from typing import Dict, List, Optional, Tuple
+import random
+import tracemalloc
+
+
+class AllocationProfiler:
+    """
+    Opt-in allocation profiling for the `executor` decorator. Tracing only
+    runs while at least one sampled request is in flight, so `sample_rate`
+    bounds the overhead. The last traced window is kept for `report`.
+    Concurrent unsampled requests inside a window are counted too, so
+    per-endpoint numbers are approximate under load.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.sample_rate = 1.0
+        self.frames = 1
+        self.endpoints: Dict[str, Dict] = {}
+        self.windows = 0
+        self._active = 0
+        self._owner = False
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._traced: Tuple[int, int] = (0, 0)
+
+    def configure(self, enabled: bool = False, sample_rate: float = 1.0, frames: int = 1) -> None:
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.frames = frames
+        if not enabled and self._owner:
+            tracemalloc.stop()
+            self._owner = False
+            self._active = 0
+
+    def sample(self) -> bool:
+        if not self.enabled:
+            return False
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def begin(self) -> int:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._owner = True
+            self.windows += 1
+        self._active += 1
+        return tracemalloc.get_traced_memory()[0]
+
+    def record(self, endpoint: str, start: int) -> None:
+        self._active = max(self._active - 1, 0)
+        if not tracemalloc.is_tracing():
+            return
+        _delta = tracemalloc.get_traced_memory()[0] - start
+        _stats = self.endpoints.setdefault(endpoint, {"requests": 0, "allocated": 0, "max_allocated": 0})
+        _stats["requests"] += 1
+        _stats["allocated"] += _delta
+        _stats["max_allocated"] = max(_stats["max_allocated"], _delta)
+        if self._active == 0 and self._owner:
+            self._snapshot = self.take_snapshot()
+            self._traced = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self._owner = False
+
+    def take_snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__),)
+        )
+
+    def top(self, limit: int = 10, key_type: str = "lineno") -> List[Dict]:
+        snapshot = self.take_snapshot() if tracemalloc.is_tracing() else self._snapshot
+        if snapshot is None:
+            return []
+        return [
+            {"location": str(stat.traceback), "size": stat.size, "count": stat.count}
+            for stat in snapshot.statistics(key_type)[:limit]
+        ]
+
+    def report(self, limit: int = 10) -> Dict:
+        current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else self._traced
+        return {
+            "sample_rate": self.sample_rate,
+            "windows": self.windows,
+            "traced": {"current": current, "peak": peak},
+            "endpoints": {
+                k: {**v, "avg_allocated": v["allocated"] // v["requests"] if v["requests"] else 0}
+                for k, v in self.endpoints.items()
+            },
+            "top": self.top(limit),
+        }
+
+
+profiler = AllocationProfiler()
@@ -0,0 +1,33 @@
+from bson import ObjectId
+from datetime import datetime
+from typing import Any, Union
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def default(value: Any) -> Any:
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson:
+    _OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def dumps(data: Any) -> bytes:
+        return orjson.dumps(data, default=default, option=_OPTIONS)
+
+    def loads(data: Union[bytes, str]) -> Any:
+        return orjson.loads(data)
+else:
+    def dumps(data: Any) -> bytes:
+        return json.dumps(data, default=default, separators=(",", ":")).encode()
+
+    def loads(data: Union[bytes, str]) -> Any:
+        return json.loads(data)
@@ -1,4 +1,18 @@
-from src.connect import mongo_client
+from pymongo import ASCENDING, IndexModel
+from src.connect import mongo_client, redis, local_cache
 
-balance_collection = mongo_client.collection("balance")
-nft_collection = mongo_client.collection("nft")
+balance_collection = mongo_client.collection(
+    "balance",
+    {"prefix_key": "balance", "redis": redis.redis if redis else None, "local": local_cache},
+    indexes=[
+        IndexModel([("address", ASCENDING)], name="address_unique", unique=True),
+    ],
+)
+nft_collection = mongo_client.collection(
+    "nft",
+    indexes=[
+        IndexModel([("address", ASCENDING), ("created_at", ASCENDING)], name="address_created_at"),
+        IndexModel([("address", ASCENDING), ("_id", ASCENDING)], name="address_id"),
+        IndexModel([("address", ASCENDING), ("nft_id", ASCENDING)], name="address_nft_id_unique", unique=True),
+    ],
+)
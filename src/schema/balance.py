@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import Optional, List
 
 
 class ChangeBalance(BaseModel):
@@ -8,5 +8,9 @@ class ChangeBalance(BaseModel):
     method: str
 
 
+class ChangeBalanceBatch(BaseModel):
+    items: List[ChangeBalance] = Field(min_length=1, max_length=5000)
+
+
 class GetBalance(BaseModel):
     address: str
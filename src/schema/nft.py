@@ -1,12 +1,19 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import Optional, List
 
 
 class ShowNFT(BaseModel):
     address: str
+    after: Optional[str] = Field(default=None, pattern=r"^[0-9a-fA-F]{24}$")
+    limit: int = Field(default=100, ge=1, le=1000)
+    stream: bool = False
 
 
 class AddNFT(BaseModel):
     address: str
     nft_id: str
     base_url: str
+
+
+class AddNFTBatch(BaseModel):
+    items: List[AddNFT] = Field(min_length=1, max_length=5000)
@@ -1,4 +1,4 @@
-from src.lib.exception import BadRequest, Forbidden, NotFound, MethodNotAllow, ConflictError, InternalServer
+from src.lib.exception import BadRequest, Forbidden, NotFound, MethodNotAllow, ConflictError, ServiceUnavailable, InternalServer
 
 
 class ErrReponse:
@@ -14,5 +14,7 @@ class ErrReponse:
             raise MethodNotAllow()
         elif status_code == 409 or status_code == "Conflict":
             raise ConflictError()
+        elif status_code == 503 or status_code == "Service unavailable":
+            raise ServiceUnavailable(errors=errors)
         else:
             raise InternalServer(errors=errors)
@@ -1,15 +1,63 @@
 from celery import Celery
+from celery.exceptions import ImproperlyConfigured
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown, worker_shutdown
 from src.config import config
 from src.connect import database, redis
 from src.lib.models import VaAccount, Bank, VaTransaction
 from src.lib.logger import logger
-from src.lib.postgres import get_session_context, set_session_context
+from src.lib.mongo import flights as mongo_flights
+from src.lib.postgres import Postgres, PostgresClient, get_session_context, set_session_context, reset_session_context
 import json
 import asyncio
+import os
+import threading
+import traceback
+
+class AsyncRunner:
+    """
+    One event loop per worker process, running in a daemon thread. Tasks are
+    submitted from Celery's pool threads and awaited there, so with the
+    `threads` pool many tasks run concurrently on the same loop and share its
+    Redis and Postgres connection pools. Each pool thread waits for its
+    coroutine, so the pool size bounds the coroutines in flight.
+    """
+
+    def __init__(self) -> None:
+        self.loop = None
+        self.pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.loop is not None and self.pid == os.getpid():
+                return self.loop
+            self.loop = asyncio.new_event_loop()
+            self.pid = os.getpid()
+            threading.Thread(target=self.loop.run_forever, name="async-runner", daemon=True).start()
+            return self.loop
+
+    def run(self, coro):
+        if self.loop is None or self.pid != os.getpid():
+            self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def stop(self):
+        if self.loop is None:
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop = None
 
-set_session_context()
 
 class AsyncCelery(Celery):
+    """
+    Celery app running its tasks on an `AsyncRunner`. The supported pool is
+    `threads`, as shipped in conf/supervisor/worker.conf. Its size is
+    `ASYNC_TASK_CONCURRENCY` unless `-c` is given. Resources are opened on the
+    first task and closed on `worker_shutdown`. The `prefork` pool also works,
+    e.g. with `-c 1`: each child then opens its own resources, and the
+    `worker_process_*` hooks, which Celery only sends for prefork, reset the
+    state a fork copied and close the child's connections.
+    """
 
     def __new__(cls, *args, **kwargs):
         if not hasattr(cls, 'instance') or not cls.instance:
@@ -18,28 +66,114 @@ class AsyncCelery(Celery):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.runner = AsyncRunner()
+        mongo_flights.enabled = config.COALESCE_READS
+        PostgresClient.flights.enabled = config.COALESCE_READS
         self.patch_task()
-        database.connect(pool_size=5, max_overflow=10, pool_recycle=7200, echo_pool="debug")
-        database.make_session(scope=get_session_context)
-        asyncio.run(self.init_redis())
-        self.redis = redis
-        self.va_account = VaAccount.apply(database.session, None)
-        self.bank = Bank.apply(database.session, None)
-        self.va_transaction = VaTransaction.apply(database.session, None)
+        self.reset_resources()
+        worker_init.connect(self.on_worker_init, weak=False)
+        worker_process_init.connect(self.on_process_init, weak=False)
+        worker_process_shutdown.connect(self.on_process_shutdown, weak=False)
+        worker_shutdown.connect(self.on_process_shutdown, weak=False)
+
+    def reset_resources(self):
+        self._resources_lock = None
+        self.redis = None
+        self.va_account = None
+        self.bank = None
+        self.va_transaction = None
+
+    async def ensure_resources(self):
+        """
+        Open the database engine, session and Redis connection of this process
+        on first use. Runs on the runner loop so every client is bound to it.
+        """
+        if self.va_account is not None:
+            return
+        if self._resources_lock is None:
+            self._resources_lock = asyncio.Lock()
+        async with self._resources_lock:
+            if self.va_account is not None:
+                return
+            self.check_config()
+            database.connect(
+                pool_size=config.POSTGRES_POOL_SIZE,
+                max_overflow=config.POSTGRES_MAX_OVERFLOW,
+                pool_recycle=config.POSTGRES_POOL_RECYCLE,
+                echo_pool="debug",
+            )
+            database.make_session(scope=get_session_context)
+            await self.init_redis()
+            self.redis = redis
+            self.va_account = VaAccount.apply(database.session, None)
+            self.bank = Bank.apply(database.session, None)
+            self.va_transaction = VaTransaction.apply(database.session, None)
+            logger.debug(f"Worker resources created in process {os.getpid()}")
+
+    async def close_resources(self):
+        if self.va_account is None:
+            return
+        if redis:
+            await redis.disconnect()
+        await database.disconnect()
+        self.reset_resources()
+        logger.debug(f"Worker resources closed in process {os.getpid()}")
+
+    def check_config(self):
+        if database is None:
+            raise ImproperlyConfigured("POSTGRES_URI is not set, the worker tasks need a Postgres database")
+
+    def on_worker_init(self, **kwargs):
+        # Fail at startup rather than on the first task.
+        self.check_config()
+
+    def on_process_init(self, **kwargs):
+        # The parent never opens connections, but drop anything a fork may
+        # have copied so the child starts from a clean state.
+        Postgres.engine = None
+        self.reset_resources()
+
+    def on_process_shutdown(self, **kwargs):
+        if self.runner.loop is None or self.runner.pid != os.getpid():
+            return
+        try:
+            self.runner.run(self.close_resources())
+        except Exception:
+            traceback.print_exc()
+        self.runner.stop()
 
     async def init_redis(self):
-        await redis.connect()
+        if redis:
+            await redis.connect()
+
+    async def execute(self, func, *args, **kwargs):
+        """
+        Run a task in its own session scope. The session is created on first use,
+        committed on success, rolled back on error and always returned to the
+        pool, so concurrent tasks never share a connection or a transaction.
+        """
+        await self.ensure_resources()
+        _context = set_session_context()
+        try:
+            _result = await func(*args, **kwargs)
+            if database.session.registry.has():
+                await database.session.commit()
+            return _result
+        except BaseException:
+            if database.session.registry.has():
+                await database.session.rollback()
+            raise
+        finally:
+            await database.session.remove()
+            reset_session_context(_context)
 
     def patch_task(self):
         TaskBase = self.Task
+        app = self
         class ContextTask(TaskBase):
             abstract = True
-            loop = asyncio.new_event_loop()
             def _run(self, *args, **kwargs):
-                result = self.loop.run_until_complete(
-                    TaskBase.__call__(self, *args, **kwargs)
-                )
-                return result
+                return app.runner.run(app.execute(TaskBase.__call__, self, *args, **kwargs))
             def __call__(self, *args, **kwargs):
                 return self._run(*args, **kwargs)
         self.Task = ContextTask
@@ -49,6 +183,7 @@ def create_worker():
     _celery = AsyncCelery(__name__, broker=config.BROKER_URL, backend=config.BROKER_URL)
     _conf_json = json.loads(config.model_dump_json())
     _celery.conf.update(_conf_json)
+    _celery.conf.worker_concurrency = config.ASYNC_TASK_CONCURRENCY
     return _celery
 
 
@@ -0,0 +1,76 @@
+from src.lib.authentication import APIKeyAuthen, JsonWebToken
+from src.lib.exception import Forbidden
+from src.lib.postgres import PostgresClient
+import asyncio
+import pytest
+
+
+def test_cached_claims_cannot_be_mutated_by_callers():
+    auth = JsonWebToken("secret", "HS256")
+    token = auth.create_token({"user_id": 1, "roles": ["user"]})["token"]
+    first = auth.decode(token)
+    first["payload"]["roles"].append("admin")
+    first["payload"]["user_id"] = 2
+    assert auth.decode(token)["payload"] == {"user_id": 1, "roles": ["user"]}
+
+
+class ApiKeyTable:
+    __tablename__ = "api_key"
+
+
+class Request:
+    def __init__(self, api_db, api_key):
+        self.headers = {"authorization": api_key}
+        self.state = type("State", (), {"_state": {"api_key": api_db}})()
+
+
+def api_db(redis, rows):
+    db = PostgresClient(ApiKeyTable, session=None, redis=redis)
+
+    async def find_one(filter, *args, **kwargs):
+        return dict(rows[filter["api_key"]]) if filter["api_key"] in rows else None
+    db.find_one = find_one
+    return db
+
+
+def test_api_key_cache_never_stores_plaintext_key():
+    fakeredis = pytest.importorskip("fakeredis.aioredis")
+
+    async def main():
+        redis = fakeredis.FakeRedis()
+        db = api_db(redis, {"secret-key": {"id": 1, "api_key": "secret-key", "role": "admin", "is_active": True}})
+        auth = APIKeyAuthen()
+        _data = await auth.validate(Request(db, "secret-key"))
+        assert "api_key" not in _data
+        for key in await redis.keys("*"):
+            if await redis.type(key) == b"string":
+                assert b"secret-key" not in await redis.get(key)
+        assert all("secret-key" not in str(v) for v, _ in auth.keys.data.values())
+        assert (await auth.validate(Request(db, "secret-key")))["id"] == 1
+    asyncio.run(main())
+
+
+def test_invalid_api_key_is_rejected_without_traceback(capsys):
+    async def main():
+        auth = APIKeyAuthen()
+        db = api_db(None, {})
+        for _ in range(3):
+            with pytest.raises(Forbidden):
+                await auth.validate(Request(db, "unknown"))
+    asyncio.run(main())
+    assert "Traceback" not in capsys.readouterr().err
+
+
+def test_unknown_api_keys_are_not_tracked():
+    fakeredis = pytest.importorskip("fakeredis")
+
+    async def main():
+        redis = fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer())
+        db = api_db(redis, {})
+        auth = APIKeyAuthen()
+        for i in range(20):
+            with pytest.raises(Forbidden):
+                await auth.validate(Request(db, f"bogus-{i}"))
+        assert await redis.zcard(db._cache_keys) == 0
+        assert 0 < await redis.pttl(db.get_key({"api_key_hash": auth._digest("bogus-0")})) <= 5000
+    asyncio.run(main())
@@ -0,0 +1,46 @@
+from src.lib.mongo import MongoCollection
+import asyncio
+import pytest
+
+
+class Latency:
+    """Delegate to a mongomock collection, yielding to the loop like a network round trip would."""
+
+    def __init__(self, collection, delay=0):
+        self.collection = collection
+        self.delay = delay
+        self.full_name = collection.full_name
+
+    def __getattr__(self, name):
+        _attr = getattr(self.collection, name)
+        if not asyncio.iscoroutinefunction(_attr):
+            return _attr
+
+        async def call(*args, **kwargs):
+            await asyncio.sleep(self.delay)
+            return await _attr(*args, **kwargs)
+        return call
+
+
+def helper(monkeypatch, delay=0):
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    monkeypatch.setenv("URI", "mongodb://localhost:27017")
+    monkeypatch.setenv("DB_NAME", "test")
+    from src.helper import balance
+    collection = Latency(mongomock_motor.AsyncMongoMockClient()["test"]["balance"], delay)
+    monkeypatch.setattr(balance, "balance_collection", MongoCollection(collection, "balance"))
+    return balance.BalanceHelper(), collection
+
+
+def test_concurrent_changes_on_one_address_are_not_lost(monkeypatch):
+    balance, collection = helper(monkeypatch)
+
+    async def main():
+        await asyncio.gather(*[
+            balance.change_balance({"address": "a", "amount": 5, "method": "+"}) for _ in range(200)
+        ])
+        await asyncio.gather(*[
+            balance.change_balance({"address": "a", "amount": 2, "method": "-"}) for _ in range(50)
+        ])
+        return await collection.find_one({"address": "a"})
+    assert asyncio.run(main())["amount"] == 200 * 5 - 50 * 2
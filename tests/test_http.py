@@ -0,0 +1,78 @@
+from src.lib.http import AsyncHttpClient, http_pool
+from src.lib.exception import ServiceUnavailable
+import asyncio
+import httpx
+import pytest
+
+
+def client_for(base_url, handler):
+    http_pool.clients[base_url] = httpx.AsyncClient(base_url=base_url, transport=httpx.MockTransport(handler))
+    return AsyncHttpClient(base_url)
+
+
+def open_breaker(client):
+    breaker = http_pool.policy(client.base_url).breaker
+    breaker.state = "open"
+    breaker.opened_at = 0.0
+    return breaker
+
+
+def test_cancelled_probe_releases_breaker():
+    async def slow(request):
+        await asyncio.sleep(1)
+        return httpx.Response(200)
+
+    async def main():
+        client = client_for("http://cancelled.test/", slow)
+        breaker = open_breaker(client)
+        task = asyncio.ensure_future(client.post("x"))
+        await asyncio.sleep(0.01)
+        assert breaker.probing
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert not breaker.probing
+        assert breaker.allow()
+    asyncio.run(main())
+
+
+def test_unexpected_error_counts_as_failure():
+    def broken(request):
+        raise httpx.DecodingError("bad body")
+
+    async def main():
+        client = client_for("http://decoding.test/", broken)
+        breaker = open_breaker(client)
+        with pytest.raises(httpx.DecodingError):
+            await client.post("x")
+        assert breaker.state == "open"
+        assert not breaker.probing
+        with pytest.raises(ServiceUnavailable):
+            await client.post("x")
+    asyncio.run(main())
+
+
+def test_hedged_request_cancels_inner_tasks():
+    started = []
+
+    async def slow(request):
+        started.append(request)
+        await asyncio.sleep(1)
+        return httpx.Response(200)
+
+    async def main():
+        http_pool.hedge_delay = 0.01
+        try:
+            client = client_for("http://hedged.test/", slow)
+            task = asyncio.ensure_future(client.get("x"))
+            await asyncio.sleep(0.05)
+            assert len(started) == 2
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            await asyncio.sleep(0)
+            pending = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            assert pending == []
+        finally:
+            http_pool.hedge_delay = None
+    asyncio.run(main())
@@ -0,0 +1,23 @@
+from pymongo import ASCENDING, IndexModel
+from src.lib.mongo import MongoClient
+import asyncio
+import pytest
+
+
+def test_failing_unique_index_does_not_block_other_indexes():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+
+    async def main():
+        client = MongoClient("mongodb://localhost/test")
+        client.collection("nft", indexes=[
+            IndexModel([("address", ASCENDING), ("nft_id", ASCENDING)], name="address_nft_id_unique", unique=True),
+            IndexModel([("address", ASCENDING), ("_id", ASCENDING)], name="address_id"),
+        ])
+        client.database = mongomock_motor.AsyncMongoMockClient()["test"]
+        await client.database["nft"].insert_many([{"address": "a", "nft_id": "1"}, {"address": "a", "nft_id": "1"}])
+        failed = await client.ensure_indexes()
+        existing = await client.database["nft"].index_information()
+        return failed, existing
+    failed, existing = asyncio.run(main())
+    assert failed == {"nft": ["address_nft_id_unique"]}
+    assert "address_id" in existing
@@ -0,0 +1,59 @@
+from src.lib.cache import Cache, LocalCache
+from src.lib import metrics
+import asyncio
+import pytest
+import time
+
+
+def sample(name, **labels):
+    return metrics.REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_local_hits_are_not_recorded_as_redis_calls():
+    fakeredis = pytest.importorskip("fakeredis.aioredis")
+
+    local = LocalCache(16, 10, "test_l1")
+
+    async def main():
+        cache = Cache(fakeredis.FakeRedis(), local)
+        await cache.set({"k": 1}, {"a": 1}, ttl=10)
+        _redis = sample("client_call_duration_seconds_count", client="redis", operation="get")
+        for _ in range(3):
+            assert await cache.get({"k": 1}) == '{"a":1}'
+        assert await cache.get({"k": 2}) is None
+        return _redis
+    _redis = asyncio.run(main())
+    assert sample("client_call_duration_seconds_count", client="redis", operation="get") == _redis + 1
+    assert sample("local_cache_requests_total", cache="test_l1", result="hit") == 3
+    assert sample("local_cache_requests_total", cache="test_l1", result="miss") == 1
+    assert local.stats() in [i.stats() for i in LocalCache.instances]
+    assert local.stats()["hits"] == 3
+
+
+def test_non_positive_ttl_is_not_cached():
+    fakeredis = pytest.importorskip("fakeredis.aioredis")
+    local = LocalCache(16, 10, "test_ttl")
+
+    async def main():
+        cache = Cache(fakeredis.FakeRedis(), local)
+        await cache.set({"ttl": 1}, {"a": 1}, ttl=0)
+        await cache.hset({"ttl": 2}, "ttl", [1], ttl=-5)
+        await cache.set({"ttl": 3}, {"a": 3})
+        return await cache.redis.keys("ttl.*")
+    assert asyncio.run(main()) == [b"ttl.3"]
+    assert local.stats()["size"] == 1
+
+
+def test_local_copy_never_outlives_redis_ttl():
+    fakeredis = pytest.importorskip("fakeredis")
+    local = LocalCache(16, 60, "test_pttl")
+
+    async def main():
+        redis = fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer())
+        await redis.set("pttl.1", "v", px=50)
+        cache = Cache(redis, local)
+        assert await cache.get({"pttl": 1}) == "v"
+        assert local.data["pttl.1"][1] - time.monotonic() <= 0.05
+        await asyncio.sleep(0.06)
+        assert await cache.get({"pttl": 1}) is None
+    asyncio.run(main())
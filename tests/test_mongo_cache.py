@@ -0,0 +1,60 @@
+from src.lib.cache import SingleFlight
+from src.lib.mongo import MongoCollection
+from src.lib import mongo
+import asyncio
+import pytest
+
+
+class Collection:
+    full_name = "db.balance"
+
+    def __init__(self, amount):
+        self.amount = amount
+        self.on_read = None
+
+    async def find_one(self, filter, projection):
+        _doc = {"address": filter["address"], "amount": self.amount}
+        if self.on_read:
+            await self.on_read()
+        return _doc
+
+
+def test_load_started_before_a_write_is_not_cached(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    monkeypatch.setattr(mongo, "flights", SingleFlight(enabled=False))
+
+    async def main():
+        collection = Collection(0)
+        dao = MongoCollection(collection, "balance", fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer()))
+
+        async def write():
+            # change_balance commits and invalidates while the old document is in flight
+            collection.amount = 100
+            await dao.invalidate({"address": "a"})
+        collection.on_read = write
+        assert (await dao.find_one({"address": "a"}, with_cache=True))["amount"] == 0
+        collection.on_read = None
+        assert (await dao.find_one({"address": "a"}, with_cache=True))["amount"] == 100
+        assert (await dao.find_one({"address": "a"}, with_cache=True))["amount"] == 100
+        assert await dao.redis.get(dao.get_key({"address": "a"})) is not None
+    asyncio.run(main())
+
+
+def test_only_driver_calls_are_observed_as_mongo_latency(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    from src.lib import metrics
+    monkeypatch.setattr(mongo, "flights", SingleFlight("mongo"))
+
+    def calls():
+        return metrics.REGISTRY.get_sample_value(
+            "client_call_duration_seconds_count", {"client": "mongo", "operation": "find_one"}) or 0
+
+    async def main():
+        collection = Collection(5)
+        collection.on_read = lambda: asyncio.sleep(0.01)
+        dao = MongoCollection(collection, "balance", fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer()))
+        _before = calls()
+        await asyncio.gather(*[dao.find_one({"address": "b"}, with_cache=True) for _ in range(5)])
+        await dao.find_one({"address": "b"}, with_cache=True)
+        return calls() - _before
+    assert asyncio.run(main()) == 1
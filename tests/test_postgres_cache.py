@@ -0,0 +1,62 @@
+from src.lib.cache import SingleFlight
+from src.lib.postgres import PostgresClient
+import asyncio
+import pytest
+
+
+class Table:
+    __tablename__ = "cached"
+
+
+def client(redis, rows):
+    dao = PostgresClient(Table, session=None, redis=redis)
+    dao.flights = SingleFlight(enabled=False)
+
+    async def _find_one(filter, projection, should_load_data):
+        return await rows(dao)
+    dao._find_one = _find_one
+    return dao
+
+
+def test_result_loaded_before_invalidation_is_not_cached():
+    fakeredis = pytest.importorskip("fakeredis.aioredis")
+
+    async def main():
+        redis = fakeredis.FakeRedis()
+
+        async def stale(dao):
+            # a concurrent update commits while the row is being read
+            await dao.invalidate_table()
+            return {"id": 1, "name": "old"}
+        dao = client(redis, stale)
+        assert await dao.find_one({"id": 1}, from_cache=True, cache=True) == {"id": 1, "name": "old"}
+        assert await redis.get(dao.get_key(dao.cache_filter({"id": 1}))) is None
+
+        async def fresh(dao):
+            return {"id": 1, "name": "new"}
+        dao = client(redis, fresh)
+        await dao.find_one({"id": 1}, from_cache=True, cache=True)
+        assert await redis.get(dao.get_key(dao.cache_filter({"id": 1}))) is not None
+        await dao.invalidate_table()
+        assert await redis.get(dao.get_key(dao.cache_filter({"id": 1}))) is None
+    asyncio.run(main())
+
+
+def test_tracked_keys_of_expired_results_are_pruned():
+    fakeredis = pytest.importorskip("fakeredis")
+
+    async def main():
+        redis = fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer())
+        dao = client(redis, None)
+        dao.track_slack = 0
+        await dao.set({"id": 0}, {"id": 0})
+        for i in range(1, 50):
+            await dao.set({"id": i}, {"id": i}, ttl=0.01)
+        await asyncio.sleep(0.05)
+        await dao.set({"id": 50}, {"id": 50}, ttl=60)
+        _keys = await redis.zrange(dao._cache_keys, 0, -1)
+        assert sorted(_keys) == [dao.get_key({"id": 0}).encode(), dao.get_key({"id": 50}).encode()]
+        await dao.invalidate_table()
+        assert await redis.get(dao.get_key({"id": 0})) is None
+        assert await redis.exists(dao._cache_keys) == 0
+    asyncio.run(main())
@@ -0,0 +1,47 @@
+from datetime import datetime
+from src.lib.exception import InternalServer
+import asyncio
+import pytest
+
+
+def test_find_rows_matches_find(tmp_path):
+    pytest.importorskip("aiosqlite")
+    from sqlalchemy import Column, DateTime, Integer, String, insert, select
+    from src.lib.postgres import Postgres, Model
+
+    class Row(Model):
+        __tablename__ = "rows_item"
+        id = Column(Integer, primary_key=True)
+        name = Column(String)
+        created_at = Column(DateTime)
+
+    class Other(Model):
+        __tablename__ = "rows_other"
+        id = Column(Integer, primary_key=True)
+
+    async def main():
+        db = Postgres(f"sqlite+aiosqlite:///{tmp_path}/rows.db")
+        db.connect()
+        db.make_session()
+        try:
+            await db.create_all()
+            dao = Row.apply(db.session, None)
+            await dao.insert(insert(Row).values([{"id": i, "name": f"n{i % 2}", "created_at": datetime(2024, 1, i + 1)} for i in range(5)]))
+            await db.session.commit()
+
+            assert await dao.find_rows({"name": "n1"}) == await dao.find({"name": "n1"})
+            assert await dao.find_rows({}, ["id", "name"]) == await dao.find({}, ["id", "name"])
+            _query = select(Row).where(Row.name == "n0").order_by(Row.id)
+            assert await dao.find_rows(_query) == await dao.find(_query)
+            assert await dao.find_rows(_query, as_tuple=True) == [(0, "n0", "2024-01-01 00:00:00"), (2, "n0", "2024-01-03 00:00:00"), (4, "n0", "2024-01-05 00:00:00")]
+            _streamed = []
+            async for rows in dao.stream_rows(_query, batch_size=2):
+                _streamed.extend(rows)
+            assert _streamed == await dao.find(_query)
+            assert await dao.find_rows(select(Row.id, Row.created_at).where(Row.id == 1)) == [{"id": 1, "created_at": "2024-01-02 00:00:00"}]
+            with pytest.raises(InternalServer):
+                await dao.find_rows(select(Other))
+        finally:
+            await db.session.remove()
+            await db.disconnect()
+    asyncio.run(main())
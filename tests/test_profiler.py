@@ -0,0 +1,29 @@
+from src.lib.profiler import AllocationProfiler
+import tracemalloc
+
+
+def test_tracing_only_runs_inside_sampled_window():
+    profiler = AllocationProfiler()
+    profiler.configure(enabled=True, sample_rate=0.5)
+    assert not tracemalloc.is_tracing()
+    first = profiler.begin()
+    second = profiler.begin()
+    assert tracemalloc.is_tracing()
+    _data = [bytearray(1024) for _ in range(10)]
+    profiler.record("a", first)
+    assert tracemalloc.is_tracing()
+    profiler.record("b", second)
+    assert not tracemalloc.is_tracing()
+    report = profiler.report()
+    assert report["windows"] == 1
+    assert report["endpoints"]["a"]["allocated"] > 0
+    assert report["top"]
+    del _data
+
+
+def test_unsampled_requests_are_not_traced():
+    profiler = AllocationProfiler()
+    profiler.configure(enabled=True, sample_rate=0)
+    assert not any(profiler.sample() for _ in range(100))
+    assert not tracemalloc.is_tracing()
+    assert profiler.report()["top"] == []
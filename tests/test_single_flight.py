@@ -0,0 +1,122 @@
+from bson import ObjectId
+from src.lib.cache import SingleFlight
+from src.lib.mongo import MongoCollection
+import asyncio
+import pytest
+
+
+def test_leader_runs_in_caller_task_and_followers_get_copies():
+    flights = SingleFlight()
+    tasks = []
+
+    async def load():
+        tasks.append(asyncio.current_task())
+        await asyncio.sleep(0.01)
+        return {"a": 1}
+
+    async def call():
+        return asyncio.current_task(), await flights.do("k", load)
+
+    async def main():
+        return await asyncio.gather(*[call() for _ in range(5)])
+    results = asyncio.run(main())
+    assert len(tasks) == 1
+    assert tasks[0] is results[0][0]
+    assert flights.executed == 1
+    assert flights.coalesced == 4
+    assert len({id(r) for _, r in results}) == 5
+    assert flights.calls == {}
+
+
+def test_followers_retry_when_leader_is_cancelled():
+    flights = SingleFlight()
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return len(calls)
+
+    async def main():
+        leader = asyncio.ensure_future(flights.do("k", load))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flights.do("k", load))
+        await asyncio.sleep(0.005)
+        leader.cancel()
+        return await follower
+    assert asyncio.run(main()) == 2
+
+
+def test_errors_reach_followers():
+    flights = SingleFlight()
+
+    async def load():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def main():
+        return await asyncio.gather(*[flights.do("k", load) for _ in range(3)], return_exceptions=True)
+    assert all(isinstance(r, ValueError) for r in asyncio.run(main()))
+
+
+def test_mongo_flight_key_is_type_exact():
+    class Collection:
+        full_name = "db.nft"
+    dao = MongoCollection(Collection())
+    _id = ObjectId()
+    assert dao.flight_key("find_one", {"_id": _id}) != dao.flight_key("find_one", {"_id": str(_id)})
+    assert dao.flight_key("find_one", {"_id": _id}) == dao.flight_key("find_one", {"_id": ObjectId(str(_id))})
+
+
+def test_postgres_reads_do_not_leak_sessions(tmp_path):
+    pytest.importorskip("aiosqlite")
+    from sqlalchemy import Column, Integer, String
+    from sqlalchemy.pool import AsyncAdaptedQueuePool
+    from src.lib.postgres import Postgres, Model
+
+    class Item(Model):
+        __tablename__ = "flight_item"
+        id = Column(Integer, primary_key=True)
+        name = Column(String)
+
+    async def main():
+        db = Postgres(f"sqlite+aiosqlite:///{tmp_path}/flight.db")
+        db.connect(poolclass=AsyncAdaptedQueuePool)
+        db.make_session()
+        try:
+            await db.create_all()
+            dao = Item.apply(db.session, None)
+
+            async def read():
+                try:
+                    return await dao.find_one({"name": "a"})
+                finally:
+                    await db.session.remove()
+            await asyncio.gather(*[read() for _ in range(3)])
+            assert db.session.registry.registry == {}
+            assert db.engine.pool.checkedout() == 0
+        finally:
+            await db.disconnect()
+    asyncio.run(main())
+
+
+def test_postgres_reads_in_transaction_are_not_coalesced(tmp_path):
+    pytest.importorskip("aiosqlite")
+    from sqlalchemy import text
+    from src.lib.postgres import Postgres, PostgresClient
+
+    async def main():
+        db = Postgres(f"sqlite+aiosqlite:///{tmp_path}/tx.db")
+        db.connect()
+        db.make_session()
+        try:
+            dao = PostgresClient.__new__(PostgresClient)
+            dao.session = db.session
+            dao._table_name = "t"
+            assert dao.flight_key({"a": 1}, False) is not None
+            await db.session.execute(text("select 1"))
+            assert dao.flight_key({"a": 1}, False) is None
+            await db.session.remove()
+        finally:
+            await db.disconnect()
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+from pymongo.errors import AutoReconnect, BulkWriteError
+from src.lib.mongo import WriteBehindQueue
+import asyncio
+
+
+class FakeCollection:
+    name = "fake"
+
+
+class FakeDao:
+    def __init__(self, errors):
+        self.collection = FakeCollection()
+        self.errors = list(errors)
+        self.calls = []
+
+    async def bulk_write(self, requests, ordered=True):
+        self.calls.append(list(requests))
+        if self.errors:
+            raise self.errors.pop(0)
+
+
+def run(dao, writes, **kwargs):
+    async def main():
+        queue = WriteBehindQueue(dao, interval=0.001, backoff_base=0.001, **kwargs)
+        for write in writes:
+            await queue.put(*write)
+        await asyncio.wait_for(queue.drain(), 1)
+        return queue
+    return asyncio.run(main())
+
+
+def inserts(count):
+    return [('insert', None, {'n': i}, False) for i in range(count)]
+
+
+def test_write_concern_error_does_not_kill_consumer():
+    _error = BulkWriteError({"writeErrors": [], "writeConcernErrors": [{"errmsg": "timeout"}]})
+    dao = FakeDao([_error, _error])
+    queue = run(dao, inserts(3))
+    assert queue.written == 3
+    assert queue.failed == 0
+
+
+def test_write_error_skips_only_failed_write():
+    _error = BulkWriteError({"writeErrors": [{"index": 1, "code": 11000, "errmsg": "dup"}]})
+    dao = FakeDao([_error])
+    queue = run(dao, inserts(3))
+    assert [len(i) for i in dao.calls] == [3, 1]
+    assert queue.written == 2
+    assert queue.failed == 1
+
+
+def test_transient_error_is_retried():
+    dao = FakeDao([AutoReconnect("down"), AutoReconnect("down")])
+    queue = run(dao, inserts(2))
+    assert len(dao.calls) == 3
+    assert queue.written == 2
+    assert queue.retried == 2
+
+
+def test_retries_are_bounded():
+    dao = FakeDao([AutoReconnect("down")] * 10)
+    queue = run(dao, inserts(2), max_retries=2)
+    assert len(dao.calls) == 3
+    assert queue.failed == 2
+
+
+def test_unexpected_error_keeps_consumer_alive():
+    dao = FakeDao([])
+
+    async def main():
+        queue = WriteBehindQueue(dao, interval=0.001)
+        await queue.put('insert', None)
+        await asyncio.sleep(0.05)
+        await queue.put(*inserts(1)[0])
+        await asyncio.wait_for(queue.drain(), 1)
+        return queue
+    queue = asyncio.run(main())
+    assert queue.failed == 1
+    assert queue.written == 1